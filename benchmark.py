@@ -0,0 +1,498 @@
+"""
+Micro-benchmarks for the PlantUML to Java generator.
+
+Run one benchmark by name, e.g.:
+
+    python benchmark.py parse
+"""
+import argparse
+import contextlib
+import io
+import mmap
+import os
+import tempfile
+import time
+import tracemalloc
+
+import generate_code
+import ir
+from cache import ParseCache, block_key, cached_parse
+from hierarchy import Hierarchy, method_signature
+from manifest import Manifest
+from parser import DiagramParser, parse_plantuml
+
+
+def make_diagram(n_classes, members_per_class=6):
+    """Builds a synthetic class diagram with `n_classes` classes, interfaces and relationships."""
+    lines = ["@startuml", "title Synthetic Diagram", ""]
+    for i in range(n_classes):
+        if i % 10 == 0:
+            lines.append(f"interface Service{i} {{")
+            lines.append(f"  + handle{i}(request: String, retries: int): boolean")
+            lines.append("}")
+            continue
+        keyword = "abstract class" if i % 10 == 1 else "class"
+        lines.append(f"' Entity {i}")
+        lines.append(f"{keyword} Entity{i} {{")
+        for m in range(members_per_class):
+            if m % 2:
+                lines.append(f"  + operation{m}(id: int, when: Date): List<String>")
+            else:
+                lines.append(f"  - field{m}: String")
+        lines.append("}")
+    lines.append("")
+    for i in range(n_classes):
+        if i % 10 > 1:
+            lines.append(f"Entity{i - i % 10 + 1} <|-- Entity{i}")
+            lines.append(f"Entity{i} ..|> Service{i - i % 10}")
+            lines.append(f'Entity{i} "1" o-- "0..*" Entity{i - 1} : owns >')
+    lines.append("@enduml")
+    return "\n".join(lines) + "\n"
+
+
+def _best_of(repeat, func, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_parse(args):
+    """Parse time for growing inputs; a flat us/line column shows linear scaling."""
+    print(f"{'classes':>8} {'lines':>9} {'seconds':>9} {'us/line':>8}")
+    for n in args.sizes:
+        text = make_diagram(n)
+        n_lines = text.count("\n")
+        seconds = _best_of(args.repeat, parse_plantuml, text)
+        print(f"{n:>8} {n_lines:>9} {seconds:>9.4f} {seconds / n_lines * 1e6:>8.2f}")
+
+
+def _dict_members(n_members):
+    """The dict-of-dicts layout the generator used before the `ir` module."""
+    elements = {}
+    for c in range(n_members // 10):
+        details = elements[f"Entity{c}"] = {'type': 'class', 'attributes': [], 'methods': []}
+        for m in range(10):
+            if m % 2:
+                details['methods'].append({'visibility': 'public', 'name': f"op{m}",
+                                           'parameters': ", ".join(["int id", "Date when"]),
+                                           'return_type': 'String'})
+            else:
+                details['attributes'].append({'visibility': 'private', 'type': 'String', 'name': f"f{m}"})
+    return elements
+
+
+def _ir_members(n_members):
+    classes = {}
+    for c in range(n_members // 10):
+        decl = classes[f"Entity{c}"] = ir.ClassDecl(name=f"Entity{c}")
+        for m in range(10):
+            if m % 2:
+                decl.methods.append(ir.MethodDecl(
+                    name=f"op{m}", return_type=ir.intern_type('String'),
+                    parameters=[ir.Parameter('id', ir.intern_type('int')),
+                                ir.Parameter('when', ir.intern_type('Date'))]))
+            else:
+                decl.attributes.append(ir.AttributeDecl(f"f{m}", ir.intern_type('String'), 'private'))
+    return classes
+
+
+def _walk_dicts(elements):
+    total = 0
+    for details in elements.values():
+        for attr in details['attributes']:
+            total += len(attr['type']) + len(attr['name'])
+        for method in details['methods']:
+            total += len(method['return_type']) + len(method['parameters'])
+    return total
+
+
+def _walk_ir(classes):
+    total = 0
+    for decl in classes.values():
+        for attr in decl.attributes:
+            total += len(attr.type) + len(attr.name)
+        for method in decl.methods:
+            total += len(method.return_type) + len(method.parameters)
+    return total
+
+
+def bench_ir(args):
+    """Memory and member-access cost of the slotted IR against the old dict layout."""
+    print(f"{'members':>8} {'layout':>6} {'MiB':>8} {'build s':>8} {'walk s':>8}")
+    for n in args.sizes:
+        n_members = n * 10
+        for label, build, walk in (('dict', _dict_members, _walk_dicts), ('ir', _ir_members, _walk_ir)):
+            tracemalloc.start()
+            model = build(n_members)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del model
+            build_seconds = _best_of(1, build, n_members)
+            model = build(n_members)
+            walk_seconds = _best_of(args.repeat, walk, model)
+            print(f"{n_members:>8} {label:>6} {size / 2**20:>8.1f} {build_seconds:>8.3f} {walk_seconds:>8.4f}")
+            del model
+
+
+def _parse_read(path):
+    with open(path, "r") as f:
+        return parse_plantuml(f.read())
+
+
+def _parse_mmap_spans(path):
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return parse_plantuml(buffer, spans=True)
+
+
+# Inputs whose str, UTF-8 bytes (span mode) and line by line parses must give the same diagram
+SPAN_EQUIVALENCE = {
+    'synthetic': lambda: make_diagram(50),
+    'non-ASCII': lambda: "@startuml\nclass Größe {\n  - maß: int\n  + berechne(wert: Maß): Größe\n}\n"
+                         "class Maß\nGröße --> Maß : → ziel\n@enduml\n",
+    'comment markers': lambda: "@startuml\n' old syntax was /' here\nclass A\nA --> B : \"a /' b\"\n"
+                               "/' open\n'/ class B /' reopened\n'/\nclass C\n@enduml\n",
+}
+
+
+def _check_span_equivalence():
+    for name, make in SPAN_EQUIVALENCE.items():
+        text = make()
+        diagram = parse_plantuml(text)
+        if diagram != parse_plantuml(text.encode('utf-8'), spans=True):
+            raise SystemExit(f"{name}: parsing the UTF-8 bytes in span mode differs from parsing the str")
+        if diagram != _parse_lines(text):
+            raise SystemExit(f"{name}: parsing line by line differs from parsing the whole str")
+
+
+def bench_memory(args):
+    """
+    Peak Python heap while parsing a file: read() into a str versus mmap +
+    span mode. First checks that both modes, and parsing line by line,
+    give the same diagram.
+    """
+    _check_span_equivalence()
+    print(f"{'classes':>8} {'input MiB':>10} {'mode':>11} {'peak MiB':>9} {'IR MiB':>7} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = os.path.join(tmp, f"diagram{n}.puml")
+            with open(path, "w") as f:
+                f.write(make_diagram(n))
+            input_size = os.path.getsize(path)
+            for label, parse in (('read', _parse_read), ('mmap+spans', _parse_mmap_spans)):
+                tracemalloc.start()
+                diagram = parse(path)
+                retained, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                del diagram
+                seconds = _best_of(1, parse, path)
+                print(f"{n:>8} {input_size / 2**20:>10.1f} {label:>11} {peak / 2**20:>9.1f} "
+                      f"{retained / 2**20:>7.1f} {seconds:>8.3f}")
+
+
+def bench_blocks(args):
+    """Wall time for a file of 32 @startuml blocks at several --jobs settings."""
+    print(f"{os.cpu_count()} CPUs available")
+    print(f"{'classes/block':>13} {'jobs':>5} {'seconds':>8} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = os.path.join(tmp, f"blocks{n}.puml")
+            with open(path, "w") as f:
+                for block in range(32):
+                    f.write(make_diagram(n).replace("Synthetic Diagram", f"Block {block}"))
+            baseline = None
+            for jobs in args.jobs:
+                out = os.path.join(tmp, f"out{n}_{jobs}")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    seconds = _best_of(1, generate_code.generate_java_code_from_file, path, out, jobs)
+                baseline = baseline or seconds
+                print(f"{n:>13} {jobs:>5} {seconds:>8.3f} {baseline / seconds:>7.2f}x")
+
+
+def bench_cache(args):
+    """Cold parse versus a parse-cache hit (key hashing plus decoding) for one block."""
+    print(f"{'classes':>8} {'parse s':>9} {'hit s':>9} {'key s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ParseCache(tmp)
+        for n in args.sizes:
+            text = make_diagram(n)
+            parse_seconds = _best_of(args.repeat, parse_plantuml, text)
+            cached_parse(cache, text)
+            hit_seconds = _best_of(args.repeat, cached_parse, cache, text)
+            key_seconds = _best_of(args.repeat, block_key, text)
+            print(f"{n:>8} {parse_seconds:>9.5f} {hit_seconds:>9.5f} {key_seconds:>9.5f}")
+
+
+def _incremental_run(diagram, output_dir):
+    manifest = Manifest.load(output_dir)
+    stats = generate_code.write_java_files(diagram, output_dir, verbose=False, manifest=manifest)
+    manifest.save()
+    return stats.written
+
+
+def bench_incremental(args):
+    """Files written and time for a first and a repeated run over the same diagram."""
+    print(f"{'classes':>8} {'run':>6} {'written':>8} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            diagram = parse_plantuml(make_diagram(n))
+            output_dir = os.path.join(tmp, f"out{n}")
+            os.makedirs(output_dir)
+            for label in ('first', 'repeat'):
+                start = time.perf_counter()
+                written = _incremental_run(diagram, output_dir)
+                print(f"{n:>8} {label:>6} {written:>8} {time.perf_counter() - start:>8.3f}")
+
+
+def bench_emit(args):
+    """Time to render and write every class of a diagram into an empty directory, per write thread count."""
+    print(f"{'classes':>8} {'threads':>8} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            diagram = parse_plantuml(make_diagram(n))
+            for threads in args.jobs:
+                best = None
+                for run in range(args.repeat):
+                    output_dir = os.path.join(tmp, f"out{n}-{threads}-{run}")
+                    os.makedirs(output_dir)
+                    start = time.perf_counter()
+                    generate_code.write_java_files(diagram, output_dir, verbose=False, write_threads=threads)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print(f"{n:>8} {threads:>8} {best:>8.3f}")
+
+
+def bench_archive(args):
+    """Time to emit a diagram as a directory of files versus one streamed archive."""
+    print(f"{'classes':>8} {'output':>8} {'seconds':>8}")
+    generator = generate_code.Generator()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = os.path.join(tmp, f"diagram{n}.puml")
+            with open(path, "w") as f:
+                f.write(make_diagram(n))
+            for fmt in ('files', 'zip', 'tar'):
+                start = time.perf_counter()
+                if fmt == 'files':
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        generator.generate_file(path, os.path.join(tmp, f"out{n}"))
+                else:
+                    generator.write_archive(path, os.path.join(tmp, f"out{n}.{fmt}"), fmt)
+                print(f"{n:>8} {fmt:>8} {time.perf_counter() - start:>8.3f}")
+
+
+def bench_calls(args):
+    """Per-call time of small generations: to disk, in memory, and through a reused Generator."""
+    calls = 200
+    generator = generate_code.Generator()
+    print(f"template compile: {_best_of(args.repeat, _compile_templates) * 1e3:.2f} ms (once per Generator/process)")
+    print(f"{'classes':>8} {'disk':>10} {'in-memory':>10} {'generator':>10}  (microseconds per call)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (1, 10, 100):
+            content = make_diagram(n)
+            output_dir = os.path.join(tmp, f"out{n}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                disk = _best_of(args.repeat, _repeat_calls, calls, generate_code.generate_java_code_from_plantuml,
+                                content, output_dir)
+            memory = _best_of(args.repeat, _repeat_calls, calls, generate_code.generate_java_sources, content)
+            reused = _best_of(args.repeat, _repeat_calls, calls, generator.sources, content)
+            print(f"{n:>8} {disk / calls * 1e6:>10.0f} {memory / calls * 1e6:>10.0f} {reused / calls * 1e6:>10.0f}")
+
+
+def _compile_templates():
+    generate_code.TemplateSet(None, generate_code._JAVA_PARAMS, generate_code._JAVA_NAMESPACE).get(generate_code.JAVA_TEMPLATE)
+
+
+def _repeat_calls(calls, func, *args):
+    for _ in range(calls):
+        func(*args)
+
+
+def make_deep_diagram(depth, n_leaves, attributes_per_class=2):
+    """Builds a diagram with a chain of `depth` classes and `n_leaves` classes extending its last one."""
+    lines = ["@startuml"]
+    for i in range(depth):
+        lines.append(f"{'abstract ' if i < depth - 1 else ''}class Level{i} {{")
+        lines.extend(f"  - level{i}Field{a}: String" for a in range(attributes_per_class))
+        lines.append("}")
+        if i:
+            lines.append(f"Level{i - 1} <|-- Level{i}")
+    for i in range(n_leaves):
+        lines.append(f"class Leaf{i} {{")
+        lines.extend(f"  - leaf{i}Field{a}: int" for a in range(attributes_per_class))
+        lines.append("}")
+        lines.append(f"Level{depth - 1} <|-- Leaf{i}")
+    lines.append("@enduml")
+    return "\n".join(lines) + "\n"
+
+
+def _naive_inherited(diagram):
+    """Inherited attributes found by walking each class's superclass chain on its own."""
+    classes = diagram.classes
+    total = 0
+    for decl in classes.values():
+        inherited = []
+        parent = classes.get(decl.superclass)
+        while parent is not None:
+            inherited[:0] = parent.attributes
+            parent = classes.get(parent.superclass)
+        total += len(inherited)
+    return total
+
+
+def _memoized_inherited(diagram):
+    hierarchy = Hierarchy(diagram)
+    return sum(len(hierarchy.inherited_attributes(name)) for name in diagram.classes)
+
+
+def bench_hierarchy(args):
+    """
+    Inheritance resolution on hierarchies 50 levels deep: every class's
+    inherited attributes walked per class versus memoized closures, and the
+    time to render every class.
+    """
+    depth = 50
+    print(f"{'leaves':>8} {'naive s':>8} {'memo s':>8} {'render s':>9}")
+    for n in (1000, 10_000):
+        diagram = parse_plantuml(make_deep_diagram(depth, n))
+        assert _naive_inherited(diagram) == _memoized_inherited(diagram)
+        naive = _best_of(args.repeat, _naive_inherited, diagram)
+        memo = _best_of(args.repeat, _memoized_inherited, diagram)
+        render = _best_of(args.repeat, lambda: list(generate_code.java_sources(diagram)))
+        print(f"{n:>8} {naive:>8.3f} {memo:>8.3f} {render:>9.3f}")
+
+
+def make_interface_diagram(width, n_classes):
+    """
+    Builds a diagram with `width` interfaces of two methods each, `width`
+    interfaces each extending ten of them, one interface extending all of
+    those, and `n_classes` classes implementing it.
+    """
+    lines = ["@startuml"]
+    for i in range(width):
+        lines.append(f"interface Base{i} {{\n  + first{i}(id: int): String\n  + second{i}(when: Date): void\n}}")
+        lines.append(f"interface Mid{i} {{\n}}")
+        lines.extend(f"Base{(i + k) % width} <|-- Mid{i}" for k in range(10))
+    lines.append("interface Service {\n}")
+    lines.extend(f"Mid{i} <|-- Service" for i in range(width))
+    for i in range(n_classes):
+        lines.append(f"class Impl{i} {{\n  + first0(id: int): String\n}}")
+        lines.append(f"Service <|.. Impl{i}")
+    lines.append("@enduml")
+    return "\n".join(lines) + "\n"
+
+
+def _naive_missing(diagram):
+    """Methods to stub found by walking each class's interfaces on their own."""
+    classes = diagram.classes
+    total = 0
+    for decl in classes.values():
+        if decl.kind != ir.CLASS:
+            continue
+        required = {}
+        stack = list(decl.interfaces)
+        while stack:
+            interface = classes[stack.pop()]
+            for method in interface.methods:
+                required.setdefault(method_signature(method), method)
+            stack.extend(interface.interfaces)
+        for method in decl.methods:
+            required.pop(method_signature(method), None)
+        total += len(required)
+    return total
+
+
+def _memoized_missing(diagram):
+    hierarchy = Hierarchy(diagram)
+    return sum(len(hierarchy.missing_methods(name)) for name in diagram.classes)
+
+
+def bench_overrides(args):
+    """
+    Finding the interface methods every class must stub, on a wide interface
+    hierarchy: per-class walks versus memoized interface closures.
+    """
+    width = 200
+    print(f"{'classes':>8} {'naive s':>8} {'memo s':>8}")
+    for n in (100, 1000):
+        diagram = parse_plantuml(make_interface_diagram(width, n))
+        assert _naive_missing(diagram) == _memoized_missing(diagram)
+        naive = _best_of(args.repeat, _naive_missing, diagram)
+        memo = _best_of(args.repeat, _memoized_missing, diagram)
+        print(f"{n:>8} {naive:>8.3f} {memo:>8.3f}")
+
+
+# Adversarial inputs of about n characters, for the linear-time guarantee of the lexer and parser
+ADVERSARIAL = {
+    'long member line': lambda n: "class A {\n+ x: " + "T" * n + "\n}\n",
+    'unclosed stereotypes': lambda n: "class A {\n+ m(a: " + "<" * n + ")\n}\n",
+    'unclosed arrow hints': lambda n: "A " + "-[" * (n // 2) + "> B\n",
+    'unclosed block comments': lambda n: "/'a" * (n // 3),
+    'reopened block comments': lambda n: "/' a\n" + "'/ /'\n" * (n // 6),
+    'unclosed strings': lambda n: '"a' * (n // 2) + "\n",
+    'brace runs': lambda n: "{" * (n // 2) + "\n" + "}" * (n // 2) + "\n",
+    'deep package nesting': lambda n: "".join(f"package p{i} {{\n" for i in range(n // 12)) +
+                                      "class A {\n+ x: int\n}\n" + "}\n" * (n // 12),
+    'nested braces in body': lambda n: "class A {\n" + "{" * (n // 2) + "}" * (n // 2) + "\n+ x: int\n}\n",
+    'long parameter list': lambda n: "class A {\n+ m(" + ", ".join(f"a{i}: Map<K, List<V>>"
+                                                                for i in range(n // 24)) + ")\n}\n",
+    'long arrow': lambda n: "A " + "-" * n + "> B\n",
+}
+
+
+def _parse_lines(text):
+    parser = DiagramParser()
+    for line in text.splitlines(keepends=True):
+        parser.feed(line)
+    return parser.close()
+
+
+def bench_adversarial(args):
+    """
+    Parses each adversarial input at 100k and 200k characters, whole and line
+    by line, and fails (exit status 1) if any run exceeds its time bound or
+    grows faster than linearly.
+    """
+    bound = 2.0 # Seconds per parse at the larger size
+    max_ratio = 3.0 # Allowed time growth when the input doubles (2 is linear)
+    failed = False
+    print(f"{'input':>24} {'mode':>6} {'100k s':>8} {'200k s':>8} {'ratio':>6}")
+    for name, make in ADVERSARIAL.items():
+        for mode, parse in (('whole', parse_plantuml), ('lines', _parse_lines)):
+            times = [_best_of(args.repeat, parse, make(n)) for n in (100_000, 200_000)]
+            ratio = times[1] / max(times[0], 1e-4)
+            ok = times[1] <= bound and (ratio <= max_ratio or times[1] < 0.01)
+            failed |= not ok
+            print(f"{name:>24} {mode:>6} {times[0]:>8.3f} {times[1]:>8.3f} {ratio:>6.1f}{'' if ok else '  FAIL'}")
+    if failed:
+        raise SystemExit(1)
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'ir': bench_ir,
+    'memory': bench_memory,
+    'blocks': bench_blocks,
+    'cache': bench_cache,
+    'incremental': bench_incremental,
+    'emit': bench_emit,
+    'calls': bench_calls,
+    'archive': bench_archive,
+    'adversarial': bench_adversarial,
+    'hierarchy': bench_hierarchy,
+    'overrides': bench_overrides,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000, 16000],
+                        help="number of classes in each synthetic diagram")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="worker or thread counts to compare (blocks and emit benchmarks)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the best is reported")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,167 @@
+"""
+Persistent, content-addressed cache of parsed diagrams.
+
+Each @startuml block is keyed by a SHA-256 of its normalized text plus
+`GENERATOR_VERSION`, and the cached value is the `ir.Diagram` encoded as
+JSON, so an unchanged block is loaded instead of being parsed again.
+Entries are plain files under the cache directory, which several processes
+or CI runners can share: writes are atomic, and `prune` evicts the least
+recently used entries once the directory grows past its size limit.
+Loading an entry only decodes data, never runs code, so a cache directory
+others can write to can at worst feed the generator a wrong diagram; an
+entry that does not decode is treated as a miss.
+"""
+import hashlib
+import json
+import os
+import re
+
+import ir
+from output import atomic_write
+from parser import parse_plantuml
+
+# Bump whenever the parser or the ir module change what a block parses to,
+# so entries written by an older generator are never reused.
+GENERATOR_VERSION = '12'
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+_TRAILING_SPACE = re.compile(r'[ \t\r\f\v]+$', re.MULTILINE)
+_TRAILING_SPACE_BYTES = re.compile(rb'[ \t\r\f\v]+$', re.MULTILINE)
+
+
+def _encode(diagram):
+    """Returns the JSON text of an `ir.Diagram`: nested lists of its fields, without its derived indexes."""
+    classes = [[decl.name, decl.kind, decl.package, decl.superclass, decl.interfaces, decl.references,
+                decl.stereotypes,
+                [[attr.name, attr.type, attr.visibility, attr.is_static] for attr in decl.attributes],
+                [[method.name, method.return_type,
+                  [[parameter.name, parameter.type] for parameter in method.parameters],
+                  method.visibility, method.is_static, method.is_abstract] for method in decl.methods]]
+               for decl in diagram.classes.values()]
+    relationships = [[r.source, r.target, r.kind, r.arrow, r.label, r.source_multiplicity, r.target_multiplicity]
+                     for r in diagram.relationships]
+    return json.dumps([diagram.name, diagram.title, classes, relationships], separators=(',', ':'))
+
+
+def _decode(text):
+    """Rebuilds the `ir.Diagram` of `_encode`, with its type names interned as the parser does."""
+    intern = ir.intern_type
+    name, title, classes, relationships = json.loads(text)
+    diagram = ir.Diagram(name, title)
+    for (class_name, kind, package, superclass, interfaces, references, stereotypes, attributes,
+         methods) in classes:
+        diagram.add_class(ir.ClassDecl(
+            intern(class_name), kind,
+            [ir.AttributeDecl(intern(attr_name), intern(attr_type), visibility, is_static)
+             for attr_name, attr_type, visibility, is_static in attributes],
+            [ir.MethodDecl(intern(method_name), intern(return_type),
+                           [ir.Parameter(intern(parameter_name), intern(parameter_type))
+                            for parameter_name, parameter_type in parameters],
+                           visibility, is_static, is_abstract)
+             for method_name, return_type, parameters, visibility, is_static, is_abstract in methods],
+            superclass, [intern(interface) for interface in interfaces], package,
+            [intern(reference) for reference in references], stereotypes))
+    for source, target, kind, arrow, label, source_multiplicity, target_multiplicity in relationships:
+        diagram.add_relationship(ir.Relationship(source, target, kind, arrow, intern(label), source_multiplicity,
+                                                 target_multiplicity))
+    return diagram
+
+
+def block_key(source):
+    """
+    Returns the cache key of one diagram block (a str or bytes-like buffer).
+    Trailing whitespace, CRLF line endings and surrounding blank lines do not
+    change the parse, so they are normalized away before hashing.
+    """
+    if isinstance(source, str):
+        data = _TRAILING_SPACE.sub('', source).strip('\n').encode('utf-8')
+    else:
+        data = _TRAILING_SPACE_BYTES.sub(b'', source).strip(b'\n')
+    digest = hashlib.sha256(GENERATOR_VERSION.encode())
+    digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk LRU cache mapping block keys to parsed diagrams.
+
+    Args:
+        cache_dir (str): Directory holding the entries; created on demand.
+        max_bytes (int): Size the directory is pruned back to by `prune`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """Returns the cached diagram for key, or None on a miss or an entry that does not decode."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                diagram = _decode(f.read())
+        except (OSError, ValueError, TypeError, LookupError):
+            return None
+        try:
+            os.utime(path) # Mark as recently used
+        except OSError:
+            pass # A read-only cache is still used, just not kept in LRU order
+        return diagram
+
+    def put(self, key, diagram):
+        """Stores a diagram under key, atomically."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, _encode(diagram))
+
+    def prune(self):
+        """
+        Deletes least recently used entries until the cache fits in max_bytes.
+        Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for name in file_names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def cached_parse(cache, source, spans=False):
+    """
+    Parses one diagram block through `cache` (a ParseCache, or None to
+    always parse). Arguments are those of `parser.parse_plantuml`.
+    """
+    if cache is None:
+        return parse_plantuml(source, spans=spans)
+    key = block_key(source)
+    diagram = cache.get(key)
+    if diagram is None:
+        diagram = parse_plantuml(source, spans=spans)
+        cache.put(key, diagram)
+    return diagram
@@ -1,220 +1,1276 @@
-import re
+import argparse
+import functools
+import json
 import os
+import posixpath
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List
+
+import ir
+from cache import DEFAULT_MAX_BYTES, ParseCache, cached_parse
+from hierarchy import Hierarchy, InheritanceCycleError
+from manifest import MANIFEST_NAME, Manifest, class_digest
+from output import (ARCHIVE_FORMATS, DuplicateEntryError, WriteStats, archive_format, remove_empty_dirs,
+                    write_archive, write_if_changed)
+from parser import DiagramParser, block_label, map_file, split_blocks
+from templating import TemplateSet
+
+
+def _block_output_dirs(labels, output_dir):
+    """
+    Maps each diagram block to its output directory: output_dir itself for a
+    single-block file, otherwise one subdirectory per block named after its
+    @startuml name or title (diagramN when it has neither). A name already
+    taken, compared as the filesystem does (os.path.normcase), gets the
+    block's number appended, and the next numbers until it is unique, so
+    no two blocks share a directory and its manifest.
+    """
+    if len(labels) == 1:
+        return [output_dir]
+    dirs = []
+    taken = set()
+    for index, label in enumerate(labels, start=1):
+        base = re.sub(r'[^\w.-]+', '_', label or '').strip('_') or f"diagram{index}"
+        dir_name = base
+        suffix = index
+        while os.path.normcase(dir_name) in taken:
+            dir_name = f"{base}_{suffix}"
+            suffix += 1
+        taken.add(os.path.normcase(dir_name))
+        dirs.append(os.path.join(output_dir, dir_name))
+    return dirs
+
 
-def generate_java_code_from_plantuml(plantuml_content, output_dir="generated_java"):
+# File extensions picked up when generating code for a whole directory tree
+DIAGRAM_EXTENSIONS = ('.puml', '.plantuml', '.pu')
+
+
+def _emit_block(diagram, output_dir, verbose, force, quarantine_dir, write_threads, template_dir, type_packages,
+                java_options):
+    """
+    Writes the Java files of one parsed block, skipping classes the output
+    manifest shows are current, and prunes the files of classes that left
+    the diagram. Returns (number of classes, WriteStats).
+    """
+    if not diagram.classes and not os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        return 0, WriteStats()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest.load(output_dir, trust_hashes=not force)
+    stats = write_java_files(diagram, output_dir, verbose=verbose, manifest=manifest, write_threads=write_threads,
+                             template_dir=template_dir, type_packages=type_packages, java_options=java_options)
+    stats.deleted += manifest.prune(diagram.classes, quarantine_dir)
+    manifest.save()
+    return len(diagram.classes), stats
+
+
+def _quarantine_dirs(block_dirs, output_dir, quarantine_dir):
+    """Mirrors each block's output directory under quarantine_dir (None when stale files are deleted)."""
+    if quarantine_dir is None:
+        return [None] * len(block_dirs)
+    return [os.path.normpath(os.path.join(quarantine_dir, os.path.relpath(block_dir, output_dir)))
+            for block_dir in block_dirs]
+
+
+def _report(results):
+    """Prints the summed WriteStats of (n_classes, stats) results and returns (classes, stats)."""
+    n_classes = sum(n for n, _ in results)
+    stats = sum((block_stats for _, block_stats in results), WriteStats())
+    print(f"Java files: {stats}")
+    return n_classes, stats
+
+
+def _generate_text_block(block_text, output_dir, verbose=True, cache=None, force=False, quarantine_dir=None,
+                         write_threads=1, template_dir=None, type_packages=None, java_options=None):
+    diagram = cached_parse(cache, block_text)
+    return _emit_block(diagram, output_dir, verbose, force, quarantine_dir, write_threads, template_dir,
+                       type_packages, java_options)
+
+
+def _generate_file_block(plantuml_file_path, start, end, output_dir, verbose=True, cache=None, force=False,
+                         quarantine_dir=None, write_threads=1, template_dir=None, type_packages=None,
+                         java_options=None):
+    with map_file(plantuml_file_path) as buffer, memoryview(buffer) as view, view[start:end] as block:
+        diagram = cached_parse(cache, block, spans=True)
+    return _emit_block(diagram, output_dir, verbose, force, quarantine_dir, write_threads, template_dir,
+                       type_packages, java_options)
+
+
+def _file_block_tasks(plantuml_file_path, output_dir, verbose=True, cache=None, force=False,
+                      quarantine_dir=None, write_threads=1, template_dir=None, type_packages=None, java_options=None,
+                      output_root=None):
+    """Splits a diagram file into one _generate_file_block task per @startuml block."""
+    with map_file(plantuml_file_path) as buffer:
+        blocks = split_blocks(buffer)
+        labels = [block_label(buffer, *span) for span in blocks]
+    dirs = _block_output_dirs(labels, output_dir)
+    quarantine_dirs = _quarantine_dirs(dirs, output_root or output_dir, quarantine_dir)
+    return [(plantuml_file_path, start, end, block_dir, verbose, cache, force, block_quarantine, write_threads,
+             template_dir, type_packages, java_options)
+            for (start, end), block_dir, block_quarantine in zip(blocks, dirs, quarantine_dirs)]
+
+
+def _run_blocks(worker, tasks, jobs):
+    """
+    Runs worker(*task) for every diagram block, in a process pool when more
+    than one job is allowed. Returns the results in task order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) == 1:
+        return [worker(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+        futures = [pool.submit(worker, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def iter_java_sources(plantuml_content, template_dir=None, type_packages=None, java_options=None):
+    """
+    Generates Java sources from PlantUML content entirely in memory: nothing
+    is written, nothing is printed, and no output directory is needed. Files
+    are laid out as `generate_java_code_from_plantuml` would write them.
+
+    Args:
+        plantuml_content: The raw PlantUML class diagram text, as a str or a
+            bytes-like buffer of UTF-8.
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones (see `java_templates`).
+        type_packages (dict): {type name: package} used to resolve imports
+            of library types (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+
+    Yields:
+        tuple: (path, Java source) for each class, where path is relative and
+        '/'-separated, e.g. 'Person.java', 'com/acme/Invoice.java' for a
+        class in package com.acme, or 'Billing/Invoice.java' when the content
+        holds several diagrams. Blocks are parsed one at a time, as
+        the iterator is consumed.
+
+    The only file ever read is a template, the first time a process uses it.
+    """
+    generator = Generator(template_dir, type_packages=type_packages, java_options=java_options)
+    return generator.iter_sources(plantuml_content)
+
+
+def generate_java_sources(plantuml_content, template_dir=None, type_packages=None, java_options=None):
+    """
+    Like `iter_java_sources`, but returns all the sources at once.
+
+    Returns:
+        dict: {path: Java source}, in diagram order.
+    """
+    return dict(iter_java_sources(plantuml_content, template_dir, type_packages, java_options))
+
+
+def generate_java_code_from_plantuml(plantuml_content, output_dir="generated_java", jobs=1, cache=None,
+                                     force=False, quarantine_dir=None, write_threads=1, template_dir=None,
+                                     type_packages=None, java_options=None):
     """
     Generates basic Java class and interface files from PlantUML class diagram content.
 
+    Every @startuml ... @enduml block is its own diagram with its own
+    namespace; when there are several, each is written to a subdirectory of
+    output_dir and independent blocks are processed in parallel.
+    `iter_java_sources` returns the same files without touching the disk.
+
     Args:
         plantuml_content (str): The raw PlantUML class diagram text.
         output_dir (str): The directory where generated Java files will be saved.
+        jobs (int): Number of worker processes for multi-block input
+            (0 or None: one per CPU).
+        cache (ParseCache): Optional parse cache; unchanged blocks are loaded
+            from it instead of being parsed.
+        force (bool): Rewrite every file instead of only the classes whose
+            IR changed since the run recorded in the output manifest.
+        quarantine_dir (str): Move the files of classes that disappeared
+            from a diagram here (mirroring the output layout) instead of
+            deleting them.
+        write_threads (int): Threads writing the Java files of each
+            diagram; >1 overlaps filesystem writes.
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones (see `java_templates`).
+        type_packages (dict): {type name: package} used to resolve imports
+            of library types (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+
+    Returns:
+        output.WriteStats: Counts of written, unchanged and deleted files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Generating Java code into: {os.path.abspath(output_dir)}")
+
+    # --- Passes 1-3: Tokenize once and parse classes, members and relationships ---
+    blocks = split_blocks(plantuml_content)
+    dirs = _block_output_dirs([block_label(plantuml_content, *span) for span in blocks], output_dir)
+    quarantine_dirs = _quarantine_dirs(dirs, output_dir, quarantine_dir)
+    tasks = [(plantuml_content[start:end], block_dir, True, cache, force, block_quarantine, write_threads,
+              template_dir, type_packages, java_options)
+             for (start, end), block_dir, block_quarantine in zip(blocks, dirs, quarantine_dirs)]
+    results = _run_blocks(_generate_text_block, tasks, jobs)
+    if cache is not None:
+        cache.prune()
+    return _report(results)[1]
+
+
+def generate_java_code_from_file(plantuml_file_path, output_dir="generated_java", jobs=1, cache=None,
+                                 force=False, quarantine_dir=None, write_threads=1, template_dir=None,
+                                 type_packages=None, java_options=None):
+    """
+    Generates Java files from a PlantUML file, parsed through a memory map so
+    that large diagrams are never copied into a Python string. Worker
+    processes map the file themselves and only receive block offsets.
+
+    Args:
+        plantuml_file_path (str): Path of the PlantUML file.
+        output_dir (str): The directory where generated Java files will be saved.
+        jobs (int): Number of worker processes for multi-block input
+            (0 or None: one per CPU).
+        cache (ParseCache): Optional parse cache; unchanged blocks are loaded
+            from it instead of being parsed.
+        force (bool): Rewrite every file instead of only the classes whose
+            IR changed since the run recorded in the output manifest.
+        quarantine_dir (str): Move the files of classes that disappeared
+            from a diagram here (mirroring the output layout) instead of
+            deleting them.
+        write_threads (int): Threads writing the Java files of each
+            diagram; >1 overlaps filesystem writes.
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones (see `java_templates`).
+        type_packages (dict): {type name: package} used to resolve imports
+            of library types (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+
+    Returns:
+        output.WriteStats: Counts of written, unchanged and deleted files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Generating Java code into: {os.path.abspath(output_dir)}")
+
+    tasks = _file_block_tasks(plantuml_file_path, output_dir, cache=cache, force=force,
+                              quarantine_dir=quarantine_dir, write_threads=write_threads,
+                              template_dir=template_dir, type_packages=type_packages, java_options=java_options)
+    results = _run_blocks(_generate_file_block, tasks, jobs)
+    if cache is not None:
+        cache.prune()
+    return _report(results)[1]
+
+
+def find_diagram_files(root):
+    """Returns the paths of all PlantUML files under root, in sorted order; hidden directories are skipped."""
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.'))
+        paths.extend(os.path.join(dir_path, name) for name in sorted(file_names)
+                     if name.endswith(DIAGRAM_EXTENSIONS))
+    return paths
+
+
+class DiagramPathError(ValueError):
+    """Two diagram files of a tree that would be generated into the same output directory."""
+
+
+def _mirrored_dirs(root, paths):
+    """
+    Returns the output directory of each diagram file, relative to the
+    output root: its path under root without the extension.
+
+    Raises:
+        DiagramPathError: If two files differ only by their extension, e.g.
+            model.puml and model.plantuml, and would share a directory and
+            its manifest.
+    """
+    owners = {}
+    relatives = []
+    for path in paths:
+        relative = os.path.splitext(os.path.relpath(path, root))[0]
+        key = os.path.normcase(relative)
+        if key in owners:
+            raise DiagramPathError(f"{owners[key]} and {path} would both be generated into {relative}{os.sep}; "
+                                   f"rename one of them")
+        owners[key] = path
+        relatives.append(relative)
+    return relatives
+
+
+def generate_java_code_from_tree(root, output_dir="generated_java", jobs=0, cache=None, force=False,
+                                 quarantine_dir=None, write_threads=1, template_dir=None, type_packages=None,
+                                 java_options=None):
+    """
+    Generates Java code for every PlantUML file under a directory tree.
+
+    The output mirrors the input layout: root/a/b/model.puml is generated into
+    output_dir/a/b/model/; two files differing only by their extension are
+    an error. The blocks of all files are scheduled together on
+    one process pool, so a few huge files and many small ones balance out.
+    Prints aggregate throughput at the end.
+
+    Args:
+        root (str): Directory to search for .puml/.plantuml/.pu files.
+        output_dir (str): Root of the mirrored output tree.
+        jobs (int): Number of worker processes (0 or None: one per CPU).
+        cache (ParseCache): Optional parse cache; unchanged blocks are loaded
+            from it instead of being parsed.
+        force (bool): Rewrite every file instead of only the classes whose
+            IR changed since the run recorded in the output manifest.
+        quarantine_dir (str): Move the files of classes that disappeared
+            from a diagram here (mirroring the output layout) instead of
+            deleting them.
+        write_threads (int): Threads writing the Java files of each
+            diagram; >1 overlaps filesystem writes.
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones (see `java_templates`).
+        type_packages (dict): {type name: package} used to resolve imports
+            of library types (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+
+    Returns:
+        tuple: (number of files, number of classes, output.WriteStats)
+
+    Raises:
+        DiagramPathError: If two files would share an output directory.
+    """
+    paths = find_diagram_files(root)
+    relatives = _mirrored_dirs(root, paths)
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Generating Java code for {os.path.abspath(root)} into: {os.path.abspath(output_dir)}")
+
+    start = time.perf_counter()
+    tasks = []
+    for path, relative in zip(paths, relatives):
+        tasks.extend(_file_block_tasks(path, os.path.join(output_dir, relative), verbose=False, cache=cache,
+                                       force=force, quarantine_dir=quarantine_dir, write_threads=write_threads,
+                                       template_dir=template_dir, type_packages=type_packages,
+                                       java_options=java_options,
+                                       output_root=output_dir))
+    results = _run_blocks(_generate_file_block, tasks, jobs) if tasks else []
+    if cache is not None:
+        cache.prune()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    n_classes, stats = _report(results)
+    print(f"Processed {len(paths)} files ({len(tasks)} diagrams, {n_classes} classes) in {elapsed:.2f}s: "
+          f"{len(paths) / elapsed:.1f} files/s, {n_classes / elapsed:.1f} classes/s")
+    return len(paths), n_classes, stats
+
+
+def _forward_imports(diagram):
+    """
+    Returns the classes a class declared after them changed the meaning of
+    a type name for: a name they reference now resolves to that later class
+    (which may need an import) or has become ambiguous. When emitted early
+    they resolved it differently.
+    """
+    classes = diagram.classes
+    order = {key: index for index, key in enumerate(classes)}
+    affected = []
+    for key, decl in classes.items():
+        for name in decl.referenced_types():
+            resolved = diagram.resolve(name, decl.package)
+            if order.get(resolved, -1) > order[key] or \
+                    resolved is None and len(diagram.simple_names.get(name, ())) > 1:
+                affected.append(key)
+                break
+    return affected
+
+
+def generate_java_code_from_stream(lines, output_dir="generated_java", quarantine_dir=None, write_threads=1,
+                                   template_dir=None, type_packages=None, java_options=None, force=False):
+    """
+    Generates Java files from an incremental stream of PlantUML lines.
+
+    Each class is written as soon as its closing brace has been parsed, so
+    parsing and emission overlap and the input is never held in memory.
+    Classes whose declaration depends on relationships declared further
+    down (extends/implements) are rewritten once their block ends. Classes
+    the output manifest already knows from an earlier run are only written
+    at the end of their block, when their final form is known, so that
+    unchanged files are not rewritten twice.
+
+    Each @startuml block gets its own namespace. Once a second block shows
+    up, the first block's files are moved into its own subdirectory so the
+    layout matches generate_java_code_from_plantuml. Blocks are labelled by
+    the same rule (`parser.block_label`), so a block whose title comes
+    after some of its classes has those moved into its directory when it
+    ends. Moved files are merged with the manifest of their directory, so
+    files a previous run left there are neither rewritten when unchanged
+    nor left behind when their class is gone. A re-run goes straight to
+    the directory the first block's classes were recorded in.
+
+    Args:
+        lines (iterable of str): The diagram, line by line (e.g. an open file).
+        output_dir (str): The directory where generated Java files will be saved.
+        quarantine_dir (str): Move the files of classes that disappeared
+            from a diagram here instead of deleting them.
+        write_threads (int): Threads writing the classes held back to the
+            end of a block.
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones.
+        type_packages (dict): {type name: package} used to resolve imports
+            of library types (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+        force (bool): Rewrite every file instead of only the classes whose
+            IR changed since the run recorded in the output manifest.
+
+    Returns:
+        output.WriteStats: Counts of file writes and removals; a class
+        rewritten at the end of its block counts once per write.
     """
     os.makedirs(output_dir, exist_ok=True)
     print(f"Generating Java code into: {os.path.abspath(output_dir)}")
 
-    # Regular expressions to find classes, abstract classes, and interfaces
-    class_pattern = re.compile(r'(?:(abstract)\s+)?class\s+(\w+)\s*\{([^}]*)\}', re.DOTALL)
-    interface_pattern = re.compile(r'interface\s+(\w+)\s*\{([^}]*)\}', re.DOTALL)
-
-    # Regular expressions to find attributes and methods within class/interface bodies
-    member_pattern = re.compile(r'^\s*([+\-#~])\s*(\w+)(?:\s*:\s*(\w+))?(?:\(([^)]*)\))?(?:\s*:\s*(\w+))?$', re.MULTILINE)
-
-    # Regular expressions to find relationships (inheritance, implementation)
-    inheritance_pattern = re.compile(r'(\w+)\s*<\|--\s*(\w+)') # Child <|-- Parent
-    implementation_pattern = re.compile(r'(\w+)\s*\.\.\|>\s*(\w+)') # Class ..|> Interface
-
-    # Store parsed classes/interfaces and their details
-    parsed_elements = {}
-    relationships = {'extends': {}, 'implements': {}}
-
-    # --- Pass 1: Parse Classes and Interfaces ---
-    for match in class_pattern.finditer(plantuml_content):
-        is_abstract, name, body = match.groups()
-        parsed_elements[name] = {
-            'type': 'abstract_class' if is_abstract else 'class',
-            'attributes': [],
-            'methods': [],
-            'body': body # Store body for later parsing of members
-        }
-
-    for match in interface_pattern.finditer(plantuml_content):
-        name, body = match = match.groups()
-        parsed_elements[name] = {
-            'type': 'interface',
-            'attributes': [], # Interfaces don't have attributes in Java/C#
-            'methods': [],
-            'body': body
-        }
-
-    # --- Pass 2: Parse Members (Attributes and Methods) ---
-    for name, details in parsed_elements.items():
-        for line in details['body'].split('\n'):
-            member_match = member_pattern.match(line.strip())
-            if member_match:
-                visibility_char, member_name, attr_type, params_str, return_type = member_match.groups()
-
-                java_visibility = {
-                    '+': 'public',
-                    '-': 'private',
-                    '#': 'protected',
-                    '~': '' # Package-private, default in Java
-                }.get(visibility_char, 'public') # Default to public if unknown
-
-                if params_str is not None: # It's a method
-                    params = []
-                    if params_str:
-                        for p in params_str.split(','):
-                            p_parts = p.strip().split(':')
-                            if len(p_parts) == 2:
-                                params.append(f"{p_parts[1].strip()} {p_parts[0].strip()}")
-                            else:
-                                params.append(p.strip()) # Fallback for malformed params
-                    java_return_type = return_type if return_type else 'void'
-                    details['methods'].append({
-                        'visibility': java_visibility,
-                        'name': member_name,
-                        'parameters': ", ".join(params),
-                        'return_type': java_return_type
-                    })
-                else: # It's an attribute
-                    java_attr_type = attr_type if attr_type else 'Object' # Default to Object if type not specified
-                    details['attributes'].append({
-                        'visibility': java_visibility,
-                        'type': java_attr_type,
-                        'name': member_name
-                    })
-
-    # --- Pass 3: Parse Relationships ---
-    for match in inheritance_pattern.finditer(plantuml_content):
-        child, parent = match.groups()
-        if child in parsed_elements and parent in parsed_elements:
-            relationships['extends'][child] = parent
-
-    for match in implementation_pattern.finditer(plantuml_content):
-        implementing_class, interface = match.groups()
-        if implementing_class in parsed_elements and interface in parsed_elements:
-            if implementing_class not in relationships['implements']:
-                relationships['implements'][implementing_class] = []
-            relationships['implements'][implementing_class].append(interface)
+    stats = WriteStats()
+    labels = [] # block_label of every finished block
+    label = None # The current block's label, as far as it has been read
+    parser = None
+    manifest = None # Manifest of the directory the current block's classes are written to, once known
+    written = [] # Classes of the current block written as soon as they were parsed
+    deferred = [] # Classes of the current block held back until it ends
+    first_block = None # The first block, finished once it is known whether another block follows
+
+    def start_block():
+        nonlocal first_block
+        if first_block is not None: # A second block: give the first one its own directory too
+            settle(*first_block, _block_output_dirs(labels + [None], output_dir)[0])
+            first_block = None
+        return DiagramParser(), None
+
+    def block_manifest():
+        if manifest is not None:
+            return manifest
+        if labels:
+            path = _block_output_dirs(labels + [label], output_dir)[-1]
+        else: # The first block: output_dir, unless a previous run recorded it in its own directory
+            path = output_dir
+            if not Manifest.load(output_dir).classes:
+                first_dir = _block_output_dirs([label, None], output_dir)[0]
+                if Manifest.load(first_dir).classes:
+                    path = first_dir
+        os.makedirs(path, exist_ok=True)
+        return Manifest.load(path, trust_hashes=not force)
+
+    def settle(diagram, affected, block, early, block_dir):
+        # Writes the classes of a finished block held back or affected by what followed them into block_dir, first
+        # moving there those written early into another directory, and prunes the classes gone from the block
+        if block is None or block.output_dir != block_dir:
+            target = Manifest.load(block_dir, trust_hashes=not force)
+            if block is not None:
+                block.transfer(early, target)
+                remove_empty_dirs(block.output_dir, output_dir)
+                affected = dict.fromkeys([*affected, *(name for name in early if name not in target.classes)])
+            block = target
+        if diagram.classes or block.classes:
+            os.makedirs(block_dir, exist_ok=True)
+            write_java_files(diagram, block_dir, affected, manifest=block, stats=stats,
+                             write_threads=write_threads, template_dir=template_dir,
+                             type_packages=type_packages, java_options=java_options)
+            block_quarantine = _quarantine_dirs([block_dir], output_dir, quarantine_dir)[0]
+            stats.deleted += block.prune(diagram.classes, block_quarantine)
+            block.save()
+
+    def finish_block():
+        nonlocal first_block
+        diagram = parser.close()
+        # Relationships change the declaration, fields and stubs of their source, and whether the parent of an
+        # extension can be a value class
+        affected = dict.fromkeys(deferred + [r.source for r in diagram.relationships] +
+                                 [r.target for r in diagram.relationships if r.kind == ir.EXTENDS] +
+                                 _forward_imports(diagram))
+        block = (diagram, affected, manifest, list(written))
+        deferred.clear()
+        written.clear()
+        if labels:
+            settle(*block, _block_output_dirs(labels + [label], output_dir)[-1])
+        else:
+            first_block = block
+        labels.append(label)
+
+    for line in lines:
+        stripped = line.strip()
+        if parser is None:
+            if not stripped or stripped.startswith("'"):
+                continue # Outside any block
+            parser, manifest = start_block()
+            label = None
+        elif stripped.startswith('@startuml'): # Previous block was never closed
+            finish_block()
+            parser, manifest = start_block()
+            label = None
+        if label is None:
+            label = block_label(line, 0, len(line))
+        decl = parser.feed(line)
+        if decl is not None:
+            manifest = block_manifest()
+            if decl.qualified_name in manifest.classes:
+                deferred.append(decl.qualified_name)
+            else:
+                write_java_files(parser.diagram, manifest.output_dir, [decl.qualified_name], manifest=manifest,
+                                 stats=stats,
+                                 template_dir=template_dir, type_packages=type_packages, java_options=java_options)
+                written.append(decl.qualified_name)
+        if stripped.startswith('@enduml'):
+            finish_block()
+            parser = None
+    if parser is not None:
+        finish_block()
+    if first_block is not None: # The only block
+        settle(*first_block, output_dir)
+    print(f"Java files: {stats}")
+    return stats
+
+
+def _format_parameters(parameters, java_options=None):
+    return ", ".join(f"{java_type(p.type, java_options)} {p.name}" if p.type else p.name for p in parameters)
+
+
+def java_file_name(decl):
+    """Returns the '/'-separated path of a class's Java file, under its package directories."""
+    if decl.package:
+        return f"{decl.package.replace('.', '/')}/{decl.name}.java"
+    return f"{decl.name}.java"
+
+
+# Package of the library types the generated code may mention, for imports
+JAVA_TYPE_PACKAGES = {
+    name: package
+    for package, names in {
+        'java.util': ['ArrayDeque', 'ArrayList', 'Arrays', 'Calendar', 'Collection', 'Collections', 'Currency',
+                      'Date', 'Deque', 'HashMap', 'HashSet', 'Iterator', 'LinkedHashMap', 'LinkedHashSet',
+                      'LinkedList', 'List', 'Locale', 'Map', 'Objects', 'Optional', 'Queue', 'Set', 'SortedMap',
+                      'SortedSet', 'TreeMap', 'TreeSet', 'UUID'],
+        'java.time': ['Duration', 'Instant', 'LocalDate', 'LocalDateTime', 'LocalTime', 'OffsetDateTime',
+                      'Period', 'Year', 'YearMonth', 'ZoneId', 'ZonedDateTime'],
+        'java.math': ['BigDecimal', 'BigInteger'],
+    }.items()
+    for name in names
+}
+
+
+# Initial capacity of the lists generated for unbounded multiplicities ('*', '0..*', ...)
+DEFAULT_COLLECTION_CAPACITY = 16
+
+
+@dataclass(slots=True, frozen=True)
+class JavaOptions:
+    """
+    Choices about the generated Java, shared by every class of a run. The
+    defaults reproduce the generator's standard output.
+
+    Args:
+        collection_capacity (int): Initial capacity of the ArrayList
+            behind an association with an unbounded multiplicity.
+        primitive_collections (str): How collections of primitives are
+            lowered; one of PRIMITIVE_COLLECTION_MODES (see `java_type`).
+        value_classes (bool): Generate every class that can be one as a
+            value class, not only those marked <<value>> (see `value_class`).
+        value_style (str): How value classes are generated; one of
+            VALUE_STYLES.
+        builders (str): Which builders classes get; one of BUILDER_MODES
+            (see `class_builder`).
+    """
+    collection_capacity: int = DEFAULT_COLLECTION_CAPACITY
+    primitive_collections: str = 'array'
+    value_classes: bool = False
+    value_style: str = 'final'
+    builders: str = 'off'
+
+
+DEFAULT_JAVA_OPTIONS = JavaOptions()
+
+# How a collection of a primitive element type, e.g. List<int>, is lowered:
+# to a primitive array (int[]), to a fastutil primitive collection (IntList)
+# or to a collection of the boxed type (List<Integer>)
+PRIMITIVE_COLLECTION_MODES = ('array', 'fastutil', 'boxed')
+
+_BOXES = {'boolean': 'Boolean', 'byte': 'Byte', 'char': 'Character', 'short': 'Short', 'int': 'Integer',
+          'long': 'Long', 'float': 'Float', 'double': 'Double'}
+_PRIMITIVE_COLLECTION = re.compile(rf"(?<![\w.])(\w+(?:\.\w+)*)\s*<\s*({'|'.join(_BOXES)})\s*>")
+_PRIMITIVE_ARGUMENT = re.compile(rf"(?<=[<,])(\s*)({'|'.join(_BOXES)})\b(?!\s*\[)")
+_SEQUENCES = frozenset({'List', 'ArrayList', 'LinkedList', 'Collection', 'Iterable'})
+# Collection interface or class -> suffix of its fastutil counterpart, e.g. List<int> -> IntList
+_FASTUTIL_COLLECTIONS = {'List': 'List', 'ArrayList': 'ArrayList', 'Collection': 'Collection',
+                         'Iterable': 'Iterable', 'Set': 'Set', 'HashSet': 'OpenHashSet',
+                         'LinkedHashSet': 'LinkedOpenHashSet', 'SortedSet': 'SortedSet'}
+FASTUTIL_TYPE_PACKAGES = {
+    f"{box[:4] if box == 'Character' else box.replace('Integer', 'Int')}{suffix}":
+        f"it.unimi.dsi.fastutil.{'char' if box == 'Character' else box.replace('Integer', 'Int').lower()}s"
+    for box in _BOXES.values()
+    for suffix in _FASTUTIL_COLLECTIONS.values()
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _lower_type(type_text, mode):
+    def collection(match):
+        qualified_name, primitive = match.groups()
+        name = qualified_name.rpartition('.')[2] # java.util.List<int> is lowered as a whole, like List<int>
+        if mode == 'array' and name in _SEQUENCES:
+            return f"{primitive}[]"
+        if mode == 'fastutil' and name in _FASTUTIL_COLLECTIONS:
+            return f"{primitive.capitalize()}{_FASTUTIL_COLLECTIONS[name]}"
+        return match.group()
+
+    lowered = _PRIMITIVE_COLLECTION.sub(collection, type_text) if '<' in type_text else type_text
+    # Any primitive left as a type argument is boxed, as Java requires
+    return _PRIMITIVE_ARGUMENT.sub(lambda match: match.group(1) + _BOXES[match.group(2)], lowered)
+
+
+def java_type(type_text, java_options=None):
+    """
+    Lowers a type as written in the diagram to the Java type generated for
+    it. Scalar primitives stay unboxed; a sequence or set of a primitive
+    element type becomes, per java_options.primitive_collections, a
+    primitive array ('array': List<int> -> int[]), a fastutil primitive
+    collection ('fastutil': List<int> -> IntList) or a boxed collection
+    ('boxed': List<int> -> List<Integer>). Primitives left as type
+    arguments (Map<String, int>) are boxed, which Java requires.
+    """
+    if '<' not in type_text:
+        return type_text
+    options = java_options if java_options is not None else DEFAULT_JAVA_OPTIONS
+    return _lower_type(type_text, options.primitive_collections)
+
+
+# Relationship kinds that give their source a field holding the target
+FIELD_RELATIONSHIPS = (ir.ASSOCIATION, ir.AGGREGATION, ir.COMPOSITION)
+_UNBOUNDED = frozenset({'*', 'n', 'many'})
+_IDENTIFIER = re.compile(r'[A-Za-z_]\w*')
+
+
+@dataclass(slots=True)
+class AssociationField:
+    """A field holding the other end of an association, aggregation or composition."""
+    name: str
+    type: str
+    initializer: str  # Java expression the field starts with, or ''
+    relationship: ir.Relationship
+
+
+def multiplicity_bounds(multiplicity):
+    """
+    Returns (lower, upper) of a multiplicity such as '1', '0..1', '1..5',
+    '*' or '0..*'; upper is None when unbounded. A missing or unreadable
+    multiplicity counts as '1'.
+    """
+    low, dots, high = multiplicity.replace(' ', '').partition('..')
+    if not dots:
+        high = low
+    if high.lower() in _UNBOUNDED:
+        upper = None
+    elif high.isdigit():
+        upper = int(high)
+    else:
+        return 1, 1
+    return (int(low) if low.isdigit() else 0), upper
+
+
+def association_fields(diagram, decl, java_options=None):
+    """
+    Returns the AssociationFields of a class: one per association,
+    aggregation or composition it is the source of, typed by the target's
+    multiplicity so that collections never grow on the way to their bound:
+
+        '1', '0..1' or none   Target
+        exactly n, e.g. '4'   Target[], a new Target[n]
+        bounded, e.g. '1..5'  List<Target>, a new ArrayList<>(5)
+        '*', '0..*', 'many'   List<Target>, a new ArrayList<> of
+                              java_options.collection_capacity
+
+    The field is named after the relationship's label when it is an
+    identifier, else after the target ('course', 'courses').
+    """
+    if decl.is_interface:
+        return []
+    options = java_options if java_options is not None else DEFAULT_JAVA_OPTIONS
+    taken = {attr.name for attr in decl.attributes}
+    fields = []
+    for relationship in diagram.graph.outgoing(decl.qualified_name, *FIELD_RELATIONSHIPS):
+        target = class_name(diagram, decl, relationship.target)
+        lower, upper = multiplicity_bounds(relationship.target_multiplicity)
+        if upper is not None and upper <= 1:
+            field_type, initializer = target, ''
+        elif upper is not None and lower == upper:
+            field_type, initializer = f"{target}[]", f"new {target}[{upper}]"
+        else:
+            field_type = f"List<{target}>"
+            initializer = f"new ArrayList<>({options.collection_capacity if upper is None else upper})"
+        if _IDENTIFIER.fullmatch(relationship.label):
+            name = relationship.label
+        else:
+            simple = diagram.classes[relationship.target].name
+            name = simple[0].lower() + simple[1:] + ('s' if initializer else '')
+        base, suffix = name, 1
+        while name in taken:
+            suffix += 1
+            name = f"{base}{suffix}"
+        taken.add(name)
+        fields.append(AssociationField(name, field_type, initializer, relationship))
+    return fields
+
+
+# How a value class is generated: as a final class with final fields, getters
+# and a cached hashCode, or as a Java 16 record
+VALUE_STYLES = ('final', 'record')
+
+# Stereotypes marking a value class; <<record>> also asks for a record
+VALUE_STEREOTYPES = frozenset({'value', 'record'})
+
+
+class ValueClassError(ValueError):
+    """A class marked as a value class that cannot be one."""
+
+
+@dataclass(slots=True)
+class ValueComponent:
+    """A field of a value class, with the Java expressions comparing, hashing and printing it."""
+    name: str
+    type: str  # Java type, as lowered by java_type
+    equals: str  # true when this.name equals other.name
+    hash: str  # int hash of this.name
+    string: str  # name as shown by toString
+
+
+@dataclass(slots=True)
+class ValueClass:
+    """How a value class is generated."""
+    record: bool
+    components: List[ValueComponent]  # The class's instance attributes, then its association fields
+    explicit: bool  # Whether equals, hashCode and toString are written out rather than derived by the compiler
+    hash_field: str  # Field caching the hash code, or '' when it is not cached
+    to_string: str  # Java expression of what toString returns, in the format of a record's
+    helpers: List[str]  # Library classes the generated methods call, e.g. Objects
+
+
+def _value_component(name, java_type_text):
+    this, other = f"this.{name}", f"other.{name}"
+    if java_type_text in _BOXES:
+        box = _BOXES[java_type_text]
+        if java_type_text in ('float', 'double'): # Float.compare, so that NaN equals itself as in the box
+            equals = f"{box}.compare({this}, {other}) == 0"
+        else:
+            equals = f"{this} == {other}"
+        return ValueComponent(name, java_type_text, equals, f"{box}.hashCode({this})", name)
+    if java_type_text.endswith('[]'):
+        if java_type_text[:-2].strip() in _BOXES:
+            return ValueComponent(name, java_type_text, f"Arrays.equals({this}, {other})",
+                                  f"Arrays.hashCode({this})", f"Arrays.toString({name})")
+        # Arrays of objects or of arrays compare their elements deeply
+        return ValueComponent(name, java_type_text, f"Arrays.deepEquals({this}, {other})",
+                              f"Arrays.deepHashCode({this})", f"Arrays.deepToString({name})")
+    return ValueComponent(name, java_type_text, f"Objects.equals({this}, {other})", f"Objects.hashCode({this})", name)
+
+
+def value_class(diagram, decl, associations=(), java_options=None):
+    """
+    Returns how class `decl` is generated as an immutable value class, or
+    None when it is an ordinary class. A class is a value class when it is
+    marked <<value>> or <<record>>, or with java_options.value_classes when
+    it can be one and has any state. Its components are its instance
+    attributes, then its `associations` fields; static attributes stay
+    static fields.
+
+    A final class (java_options.value_style 'final') gets final fields, a
+    constructor taking every component, getters and no setters, and
+    equals/hashCode/toString over the components, with the hash code
+    cached on first use. A record ('record', or <<record>>) leaves
+    those to the compiler, unless a component is an array, which records
+    would compare by identity.
+
+    Raises:
+        ValueClassError: If a class marked as a value class is an interface
+            or abstract class, or extends or is extended by another class.
+    """
+    options = java_options if java_options is not None else DEFAULT_JAVA_OPTIONS
+    marked = not VALUE_STEREOTYPES.isdisjoint(decl.stereotypes)
+    if not (marked or options.value_classes):
+        return None
+    if decl.kind != ir.CLASS or decl.superclass or diagram.graph.sources(decl.qualified_name, ir.EXTENDS):
+        if marked:
+            raise ValueClassError(f"{decl.name} is marked as a value class but is abstract, an interface or "
+                                  f"part of a class hierarchy")
+        return None
+    components = [_value_component(attr.name, java_type(attr.type, options))
+                  for attr in decl.attributes if not attr.is_static]
+    components += [_value_component(field.name, field.type) for field in associations]
+    if not (marked or components):
+        return None
+    record = options.value_style == 'record' or 'record' in decl.stereotypes
+    explicit = not record or any(component.type.endswith('[]') for component in components)
+    hash_field = ''
+    if not record:
+        taken = {attr.name for attr in decl.attributes} | {component.name for component in components}
+        hash_field, suffix = 'hash', 1
+        while hash_field in taken:
+            suffix += 1
+            hash_field = f"hash{suffix}"
+    to_string = f'"{decl.name}['
+    for i, component in enumerate(components):
+        to_string += f'{", " if i else ""}{component.name}=" + {component.string} + "'
+    to_string += ']"'
+    helpers = set()
+    if explicit:
+        for component in components:
+            for expression in (component.equals, component.hash, component.string):
+                helper = expression.partition('.')[0]
+                if helper in ('Objects', 'Arrays'):
+                    helpers.add(helper)
+    return ValueClass(record, components, explicit, hash_field, to_string, sorted(helpers))
+
+
+# Builders generated for classes: none, a new builder per builder() call, or
+# one pooled builder per class and thread, reset and reused by builder()
+BUILDER_MODES = ('off', 'builder', 'pooled')
+
+
+@dataclass(slots=True)
+class BuilderProperty:
+    """A constructor argument set by name on a builder."""
+    name: str
+    type: str  # Java type, as lowered by java_type
+    default: str  # Java literal the property is reset to
+    inherited: bool  # Whether the builder of the superclass declares it
+
+
+@dataclass(slots=True)
+class BuilderClass:
+    """How the nested Builder of a class is generated."""
+    properties: List[BuilderProperty]  # The constructor's parameters, in order
+    parent: str  # Superclass whose Builder this one extends, or ''
+    abstract: bool  # Builder of an abstract class, which has no build() body and no factory
+    pooled: bool  # Whether the builder can be reset
+    pool_field: str  # Static field holding each thread's builder, or '' when builder() creates one
+
+
+def _default_value(java_type_text):
+    if java_type_text == 'boolean':
+        return 'false'
+    if java_type_text == 'char':
+        return "'\\0'"
+    return '0' if java_type_text in _BOXES else 'null'
+
+
+def class_builder(diagram, decl, hierarchy, value=None, java_options=None):
+    """
+    Returns how the nested Builder of a class is generated, or None when
+    java_options.builders is 'off' or decl is an interface. A Builder has
+    a setter per constructor parameter, named after it, and a build()
+    calling the constructor, so that classes deep in a hierarchy are built
+    by name instead of through one long positional parameter list. The
+    static factory builder() returns one.
+
+    The Builder of a subclass extends that of its superclass, which sets
+    the inherited attributes, and overrides their setters only to return
+    its own type; an abstract class gets an abstract Builder. With
+    builders 'pooled', builder() hands out the calling thread's builder
+    of the class, reset, rather than allocating one; it stays valid until
+    the next builder() call of the same class on that thread.
+    """
+    options = java_options if java_options is not None else DEFAULT_JAVA_OPTIONS
+    if options.builders == 'off' or decl.is_interface:
+        return None
+    if value is not None:
+        properties = [BuilderProperty(component.name, component.type, _default_value(component.type), False)
+                      for component in value.components]
+        parent = ''
+    else:
+        properties = []
+        inherited_attributes = hierarchy.inherited_attributes(decl.qualified_name)
+        own_attributes = [attr for attr in decl.attributes if not attr.is_static]
+        for attributes, inherited in ((inherited_attributes, True), (own_attributes, False)):
+            for attr in attributes:
+                attr_type = java_type(attr.type, options)
+                properties.append(BuilderProperty(attr.name, attr_type, _default_value(attr_type), inherited))
+        parent = class_name(diagram, decl, decl.superclass) if decl.superclass in diagram.classes else ''
+    pooled = options.builders == 'pooled'
+    abstract = decl.kind == ir.ABSTRACT_CLASS
+    pool_field = ''
+    if pooled and not abstract:
+        taken = {attr.name for attr in decl.attributes}
+        pool_field, suffix = 'BUILDER', 1
+        while pool_field in taken:
+            suffix += 1
+            pool_field = f"BUILDER{suffix}"
+    return BuilderClass(properties, parent, abstract, pooled, pool_field)
+
+
+def _lowered_names(type_texts, java_options):
+    names = set()
+    for type_text in type_texts:
+        names.update(ir.type_names(java_type(type_text, java_options)))
+    return names
+
+
+def _method_types(method):
+    yield method.return_type
+    for parameter in method.parameters:
+        yield parameter.type
+
+
+def _member_types(decl):
+    for attr in decl.attributes:
+        yield attr.type
+    for method in decl.methods:
+        yield from _method_types(method)
+
+
+def class_name(diagram, decl, key):
+    """
+    Returns how the source of class `decl` names the class `key` of the
+    diagram: by its simple name when that resolves to it from decl's
+    package, else by its qualified name. Names of classes outside the
+    diagram are returned as they are.
+    """
+    other = diagram.classes.get(key)
+    if other is None or diagram.resolve(other.name, decl.package) != key:
+        return key
+    return other.name
+
+
+def java_imports(diagram, decl, type_packages=None, hierarchy=None, associations=(), java_options=None,
+                 value=None):
+    """
+    Returns the sorted imports of a class, resolved from the type names it
+    mentions (its `references`, parents, the inherited attributes its
+    constructor takes, the inherited methods it gets stubs for, its
+    `associations` fields and the helpers its `value` class methods call),
+    as lowered by `java_type`, against the symbol table: the diagram's
+    classes first (see `ir.Diagram.resolve`), then type_packages, a {type
+    name: package} map (JAVA_TYPE_PACKAGES by default), then the fastutil
+    types. Types in java.lang, in the class's own package or written fully
+    qualified need no import, nor do diagram classes whose simple name is
+    ambiguous, which the class names by their qualified name (see
+    `class_name`). Pass the diagram's `hierarchy.Hierarchy` when resolving
+    many classes.
+    """
+    type_packages = JAVA_TYPE_PACKAGES if type_packages is None else type_packages
+    classes = diagram.classes
+    names = set(decl.references)
+    if any(java_type(type_text, java_options) != type_text for type_text in _member_types(decl)):
+        # Lowering replaced some types (List<int> -> int[]): collect the names of the lowered ones instead
+        names = _lowered_names(_member_types(decl), java_options)
+    names.update(class_name(diagram, decl, key) for key in decl.referenced_types().difference(decl.references))
+    if not decl.is_interface:
+        hierarchy = hierarchy if hierarchy is not None else Hierarchy(diagram)
+        names.update(_lowered_names((attr.type for attr in hierarchy.inherited_attributes(decl.qualified_name)),
+                                    java_options))
+        for _, method in hierarchy.missing_methods(decl.qualified_name):
+            names.update(_lowered_names(_method_types(method), java_options))
+    for field in associations: # The initializer names the implementation, e.g. ArrayList
+        names.update(ir.type_names(field.type))
+        if value is None: # Value classes take every field through their constructor
+            names.update(ir.type_names(field.initializer))
+    if value is not None:
+        names.update(value.helpers)
+    imports = set()
+    for name in names:
+        if '.' in name and name in classes: # A diagram class named by its qualified name
+            continue
+        name = name.partition('.')[0] # Map.Entry needs Map; java.util.Date needs nothing
+        key = diagram.resolve(name, decl.package)
+        package = classes[key].package if key is not None else \
+            type_packages.get(name) or FASTUTIL_TYPE_PACKAGES.get(name)
+        if package and package != decl.package and package != 'java.lang':
+            imports.add(f"{package}.{name}")
+    return sorted(imports)
+
+
+JAVA_TEMPLATE = 'class.java'
+
+# Parameters of every Java template, and the globals visible to them
+_JAVA_PARAMS = ('diagram', 'decl', 'imports', 'hierarchy', 'associations', 'value', 'builder', 'options')
+_JAVA_NAMESPACE = {'ir': ir, 'format_parameters': _format_parameters, 'java_type': java_type,
+                   'class_name': class_name}
+
+_template_sets = {}
+
+
+def java_templates(template_dir=None):
+    """
+    Returns the process-wide `templating.TemplateSet` of the Java templates,
+    with those in template_dir overriding the built-in ones. Each template is
+    compiled once per process.
+    """
+    templates = _template_sets.get(template_dir)
+    if templates is None:
+        templates = _template_sets.setdefault(
+            template_dir, TemplateSet(template_dir, _JAVA_PARAMS, _JAVA_NAMESPACE))
+    return templates
+
+
+def _render(render, diagram, decl, hierarchy, type_packages, java_options):
+    options = java_options if java_options is not None else DEFAULT_JAVA_OPTIONS
+    associations = association_fields(diagram, decl, options)
+    value = value_class(diagram, decl, associations, options)
+    imports = java_imports(diagram, decl, type_packages, hierarchy, associations, options, value)
+    builder = class_builder(diagram, decl, hierarchy, value, options)
+    return render(diagram, decl, imports, hierarchy, associations, value, builder, options)
+
+
+def render_java_class(diagram, decl, templates=None, type_packages=None, java_options=None):
+    """
+    Returns the Java source of one class/interface of an `ir.Diagram`,
+    rendered by the `class.java` template of `templates` (the built-in
+    templates by default) with the imports of `java_imports`.
+    """
+    templates = templates if templates is not None else java_templates()
+    return _render(templates.get(JAVA_TEMPLATE), diagram, decl, Hierarchy(diagram), type_packages, java_options)
+
+
+def java_sources(diagram, names=None, templates=None, type_packages=None, java_options=None, hierarchy=None):
+    """
+    Renders the classes of an `ir.Diagram` in memory, without any I/O.
+
+    Args:
+        diagram (ir.Diagram): The parsed diagram.
+        names (iterable of str): Qualified names (keys of diagram.classes) of
+            the classes to render; all by default.
+        templates (templating.TemplateSet): Templates to render with; the
+            built-in ones by default.
+        type_packages (dict): {type name: package} of library types, for
+            `java_imports`.
+        java_options (JavaOptions): Choices about the generated Java.
+        hierarchy (hierarchy.Hierarchy): The diagram's inheritance
+            closures, if already built; shared by every class rendered.
+
+    Yields:
+        tuple: (file name, Java source) for each class, in order.
+    """
+    classes = diagram.classes
+    templates = templates if templates is not None else java_templates()
+    render = templates.get(JAVA_TEMPLATE)
+    hierarchy = hierarchy if hierarchy is not None else Hierarchy(diagram)
+    for name in (classes if names is None else names):
+        decl = classes[name]
+        yield java_file_name(decl), _render(render, diagram, decl, hierarchy, type_packages, java_options)
+
+
+def write_java_files(diagram, output_dir, names=None, verbose=True, manifest=None, stats=None, write_threads=1,
+                     template_dir=None, type_packages=None, java_options=None):
+    """
+    Writes one Java file per class/interface of an `ir.Diagram` into output_dir.
+    If `names` (qualified names) is given, only those classes are written.
+    With verbose, each written file is reported on stdout.
+
+    Every file is rendered in memory and only replaced, atomically, when its
+    content differs from what is on disk, so unchanged files keep their
+    mtime and readers never see a partial file. This is the disk layer over
+    what `java_sources` renders. With write_threads > 1, each class is
+    rendered and written by a task of a bounded thread pool, sharing one
+    `hierarchy.Hierarchy`, so that slow filesystem writes overlap; results
+    are still collected, reported and recorded in class order, so the
+    outcome does not depend on scheduling.
+
+    Files are rendered from the Java templates; those in template_dir
+    override the built-in ones (see `java_templates`). type_packages maps
+    library types to their packages for imports (see `java_imports`), and
+    java_options holds the other choices about the generated Java.
+
+    With a `manifest.Manifest`, classes whose IR (and the IR they depend on)
+    and templates hash to what the manifest recorded are skipped without
+    rendering, and every emitted file is recorded in it; the caller saves
+    the manifest.
+
+    Returns:
+        output.WriteStats: Counts of written and unchanged files, added to
+        `stats` when one is passed in.
+    """
+    classes = diagram.classes
+    stats = stats if stats is not None else WriteStats()
+    templates = java_templates(template_dir)
+    template_key = None
+    if manifest is not None: # Everything besides the IR that the output depends on
+        template_key = templates.fingerprint(JAVA_TEMPLATE)
+        if type_packages is not None:
+            template_key += repr(sorted(type_packages.items()))
+        if java_options is not None:
+            template_key += repr(java_options)
 
     # --- Pass 4: Generate Java Files ---
-    for name, details in parsed_elements.items():
-        file_name = os.path.join(output_dir, f"{name}.java")
-        with open(file_name, 'w') as f:
-            # Package declaration (optional, can be added if needed)
-            # f.write("package com.university.model;\n\n")
-
-            # Imports (basic Date and List for common types)
-            if any(attr['type'] == 'Date' for attr in details['attributes']) or \
-               any('Date' in m['parameters'] or 'Date' in m['return_type'] for m in details['methods']):
-                f.write("import java.util.Date;\n")
-            if any('List' in attr['type'] for attr in details['attributes']) or \
-               any('List' in m['parameters'] or 'List' in m['return_type'] for m in details['methods']):
-                f.write("import java.util.List;\n")
-                f.write("import java.util.ArrayList;\n")
-            if f.tell() > 0: # Add newline if imports were written
-                f.write("\n")
-
-            # Class/Interface declaration
-            declaration_line = ""
-            if details['type'] == 'abstract_class':
-                declaration_line = f"public abstract class {name}"
-            elif details['type'] == 'class':
-                declaration_line = f"public class {name}"
-            elif details['type'] == 'interface':
-                declaration_line = f"public interface {name}"
-
-            # Add extends clause
-            if name in relationships['extends']:
-                declaration_line += f" extends {relationships['extends'][name]}"
-
-            # Add implements clause
-            if name in relationships['implements']:
-                interfaces = ", ".join(relationships['implements'][name])
-                declaration_line += f" implements {interfaces}"
-
-            f.write(f"{declaration_line} {{\n")
-
-            # Attributes
-            for attr in details['attributes']:
-                f.write(f"    {attr['visibility']} {attr['type']} {attr['name']};\n")
-            if details['attributes']:
-                f.write("\n") # Add newline after attributes if any
-
-            # Constructor (basic, only for classes, not interfaces)
-            if details['type'] != 'interface':
-                # Simple constructor with all attributes as parameters
-                constructor_params = []
-                for attr in details['attributes']:
-                    constructor_params.append(f"{attr['type']} {attr['name']}")
-                
-                # If extending a class, add parent constructor parameters (heuristic)
-                parent_class = relationships['extends'].get(name)
-                if parent_class and parent_class in parsed_elements and parsed_elements[parent_class]['type'] != 'interface':
-                    parent_attrs = parsed_elements[parent_class]['attributes']
-                    parent_constructor_params = [f"{attr['type']} {attr['name']}" for attr in parent_attrs]
-                    constructor_params = parent_constructor_params + constructor_params
-                    
-                    # Add super() call
-                    super_call_params = [attr['name'] for attr in parent_attrs]
-                    if super_call_params:
-                        f.write(f"    public {name}({', '.join(constructor_params)}) {{\n")
-                        f.write(f"        super({', '.join(super_call_params)});\n")
-                        for attr in details['attributes']:
-                            f.write(f"        this.{attr['name']} = {attr['name']};\n")
-                        f.write("    }\n\n")
-                    else:
-                        f.write(f"    public {name}({', '.join(constructor_params)}) {{\n")
-                        for attr in details['attributes']:
-                            f.write(f"        this.{attr['name']} = {attr['name']};\n")
-                        f.write("    }\n\n")
-                else:
-                    f.write(f"    public {name}({', '.join(constructor_params)}) {{\n")
-                    for attr in details['attributes']:
-                        f.write(f"        this.{attr['name']} = {attr['name']};\n")
-                    f.write("    }\n\n")
-
-
-            # Getters and Setters (for private attributes)
-            for attr in details['attributes']:
-                if attr['visibility'] == 'private':
-                    # Getter
-                    f.write(f"    public {attr['type']} get{attr['name'].capitalize()}() {{\n")
-                    f.write(f"        return {attr['name']};\n")
-                    f.write("    }\n\n")
-                    # Setter
-                    f.write(f"    public void set{attr['name'].capitalize()}({attr['type']} {attr['name']}) {{\n")
-                    f.write(f"        this.{attr['name']} = {attr['name']};\n")
-                    f.write("    }\n\n")
-
-            # Methods
-            for method in details['methods']:
-                method_modifier = ""
-                if details['type'] == 'abstract_class' and method['visibility'] == 'public' and 'abstract' in method['name'].lower():
-                    method_modifier = "abstract "
-                    method['name'] = method['name'].replace('{abstract}', '').strip() # Remove {abstract} from name
-                elif details['type'] == 'interface':
-                    # Methods in interfaces are implicitly public and abstract in Java 8+
-                    method_modifier = ""
-                    method['visibility'] = "public" # Ensure public for interface methods
-                    
-                # Handle static methods
-                if '{static}' in method['name'].lower():
-                    method_modifier += "static "
-                    method['name'] = method['name'].replace('{static}', '').strip()
-
-                f.write(f"    {method['visibility']} {method_modifier}{method['return_type']} {method['name']}({method['parameters']})")
-                if details['type'] == 'interface' or method_modifier.strip() == 'abstract':
-                    f.write(";\n\n") # Abstract methods and interface methods end with semicolon
-                else:
-                    f.write(" {\n")
-                    f.write("        // TODO: Implement method logic\n")
-                    if method['return_type'] != 'void':
-                        f.write(f"        return default{method['return_type']}Value(); // Placeholder return\n")
-                    f.write("    }\n\n")
-
-            f.write("}\n")
-            print(f"Generated {name}.java")
+    hierarchy = Hierarchy(diagram) # Inheritance closures shared by the digests and the rendering
+    pending = [] # (name, file name, manifest digest) of the classes to emit
+    for name in (classes if names is None else names):
+        file_name = java_file_name(classes[name])
+        digest = None
+        if manifest is not None:
+            digest = class_digest(diagram, classes[name], template_key, hierarchy)
+            if manifest.is_current(name, file_name, digest):
+                stats.unchanged += 1
+                continue
+        pending.append((name, file_name, digest))
+
+    render = templates.get(JAVA_TEMPLATE)
+
+    def emit(item): # Renders and writes one class, on a pool thread when there is a pool
+        name, file_name, _ = item
+        source = _render(render, diagram, classes[name], hierarchy, type_packages, java_options)
+        path = os.path.join(output_dir, file_name)
+        if '/' in file_name:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return write_if_changed(path, source)
+
+    if write_threads > 1 and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=write_threads) as pool:
+            results = list(pool.map(emit, pending))
+    else:
+        results = map(emit, pending)
+    for (name, file_name, digest), written in zip(pending, results):
+        if written:
+            stats.written += 1
+            if verbose:
+                print(f"Generated {file_name}")
+        else:
+            stats.unchanged += 1
+        if manifest is not None:
+            manifest.record(name, file_name, digest)
+    return stats
+
+class Generator:
+    """
+    Reusable PlantUML to Java generator.
+
+    Holds everything that does not depend on the input: the compiled
+    templates (compiled when the generator is created, so calls never read
+    template files) and the options of a run. The lexer grammar and type
+    tables are compiled once per process, at import. A Generator has no
+    per-call state and can be shared between threads; create one and reuse
+    it for every call instead of going through the module-level functions.
+
+    Args:
+        template_dir (str): Directory of Java templates overriding the
+            built-in ones.
+        cache (ParseCache): Optional parse cache for the disk methods.
+        jobs (int): Worker processes for multi-block input, 0 for one per
+            CPU; None for the defaults of the module-level functions (1 for
+            a file, one per CPU for a directory tree).
+        write_threads (int): Threads writing the Java files of each diagram.
+        force (bool): Rewrite every file, ignoring the output manifest.
+        quarantine_dir (str): Move the files of removed classes here
+            instead of deleting them.
+        type_packages (dict): {type name: package} of the library types to
+            import (default: JAVA_TYPE_PACKAGES).
+        java_options (JavaOptions): Choices about the generated Java;
+            the defaults when None.
+    """
+
+    def __init__(self, template_dir=None, cache=None, jobs=None, write_threads=1, force=False, quarantine_dir=None,
+                 type_packages=None, java_options=None):
+        self.template_dir = template_dir
+        self.type_packages = type_packages
+        self.java_options = java_options
+        self.templates = java_templates(template_dir)
+        self.templates.get(JAVA_TEMPLATE) # Compile now rather than on the first call
+        self.cache = cache
+        self.jobs = jobs
+        self.write_threads = write_threads
+        self.force = force
+        self.quarantine_dir = quarantine_dir
+
+    def iter_sources(self, plantuml_content, prefix='', package_root=False):
+        """
+        Yields the (path, Java source) pairs of `iter_java_sources`, with paths
+        under the '/'-separated prefix. With package_root, paths are instead
+        the package paths of the classes alone (`java_file_name`), whatever
+        the prefix and block, as in a source jar. There is no I/O unless the
+        generator has a parse cache.
+        """
+        is_text = isinstance(plantuml_content, str)
+        blocks = split_blocks(plantuml_content)
+        dirs = _block_output_dirs([block_label(plantuml_content, *span) for span in blocks], prefix)
+        for (start, end), block_dir in zip(blocks, dirs):
+            if is_text:
+                diagram = cached_parse(self.cache, plantuml_content[start:end])
+            else:
+                with memoryview(plantuml_content) as view, view[start:end] as block:
+                    diagram = cached_parse(self.cache, block, spans=True)
+            for file_name, source in java_sources(diagram, templates=self.templates,
+                                                  type_packages=self.type_packages, java_options=self.java_options):
+                yield (file_name if package_root else posixpath.join(block_dir, file_name)), source
+
+    def iter_file_sources(self, plantuml_file_path, prefix='', package_root=False):
+        """Like `iter_sources`, for a diagram file read through an mmap."""
+        with map_file(plantuml_file_path) as buffer:
+            yield from self.iter_sources(buffer, prefix, package_root)
+
+    def iter_tree_sources(self, root, package_root=False):
+        """
+        Like `iter_sources`, for every diagram file under a directory tree;
+        paths mirror the input layout as in `generate_java_code_from_tree`,
+        unless package_root.
+        """
+        for path in find_diagram_files(root):
+            relative = os.path.splitext(os.path.relpath(path, root))[0]
+            yield from self.iter_file_sources(path, relative.replace(os.sep, '/'), package_root)
+
+    def sources(self, plantuml_content):
+        """Returns {path: Java source}, like `generate_java_sources`."""
+        return dict(self.iter_sources(plantuml_content))
+
+    def render(self, diagram, names=None):
+        """Yields the (file name, Java source) pairs of an already parsed `ir.Diagram`."""
+        return java_sources(diagram, names, self.templates, self.type_packages, self.java_options)
+
+    def _options(self):
+        return dict(cache=self.cache, force=self.force, quarantine_dir=self.quarantine_dir,
+                    write_threads=self.write_threads, template_dir=self.template_dir,
+                    type_packages=self.type_packages, java_options=self.java_options)
+
+    def generate(self, plantuml_content, output_dir="generated_java"):
+        """Writes the Java files of PlantUML text; see `generate_java_code_from_plantuml`."""
+        jobs = 1 if self.jobs is None else self.jobs
+        return generate_java_code_from_plantuml(plantuml_content, output_dir, jobs, **self._options())
+
+    def generate_file(self, plantuml_file_path, output_dir="generated_java"):
+        """Writes the Java files of a diagram file; see `generate_java_code_from_file`."""
+        jobs = 1 if self.jobs is None else self.jobs
+        return generate_java_code_from_file(plantuml_file_path, output_dir, jobs, **self._options())
+
+    def generate_tree(self, root, output_dir="generated_java"):
+        """Writes the Java files of a directory of diagrams; see `generate_java_code_from_tree`."""
+        jobs = 0 if self.jobs is None else self.jobs
+        return generate_java_code_from_tree(root, output_dir, jobs, **self._options())
+
+    def write_archive(self, plantuml_path, target, fmt=None):
+        """
+        Generates the Java files of a diagram file or directory tree straight
+        into one archive, in a single sequential pass with no intermediate
+        files; see `output.write_archive`. A zip or jar has the source-jar
+        layout, package directories at its root; a tar mirrors the output
+        directories of the disk methods.
+
+        Args:
+            plantuml_path (str): Diagram file, or directory of diagrams.
+            target: Archive path, or a binary stream such as sys.stdout.buffer.
+            fmt (str): 'zip', 'jar', 'tar' or 'tar.gz'; inferred from the
+                target's extension when None.
+
+        Returns:
+            int: The number of Java files in the archive.
+
+        Raises:
+            DuplicateEntryError: If two classes (of different blocks or
+                diagram files) have the same path in the archive.
+        """
+        if fmt is None:
+            fmt = archive_format(target) if isinstance(target, str) else None
+            if fmt is None:
+                raise ValueError(f"cannot infer the archive format of {target!r}")
+        package_root = fmt in ('zip', 'jar')
+        if os.path.isdir(plantuml_path):
+            entries = self.iter_tree_sources(plantuml_path, package_root)
+        else:
+            entries = self.iter_file_sources(plantuml_path, package_root=package_root)
+        return write_archive(entries, target, fmt)
+
+    def generate_stream(self, lines, output_dir="generated_java"):
+        """Writes Java files while a diagram is being read; see `generate_java_code_from_stream`."""
+        return generate_java_code_from_stream(lines, output_dir, self.quarantine_dir, self.write_threads,
+                                              self.template_dir, self.type_packages, self.java_options, self.force)
 
 # Helper function for placeholder return values
 def default_return_value(java_type):
@@ -231,7 +1287,62 @@ def default_return_value(java_type):
 
 # Add this to the end of your script to make it runnable
 if __name__ == "__main__":
-    plantuml_file_path = "university_diagram.puml" # Change this to your PlantUML file name
+    arg_parser = argparse.ArgumentParser(description="Generate Java code from a PlantUML class diagram.")
+    arg_parser.add_argument("plantuml_file", nargs="?", default="university_diagram.puml",
+                            help="PlantUML file to read, or a directory to generate code for every "
+                                 ".puml/.plantuml/.pu file below it (default: %(default)s)")
+    arg_parser.add_argument("-o", "--output-dir", default="generated_java",
+                            help="directory for the generated Java files (default: %(default)s)")
+    arg_parser.add_argument("--input", choices=["mmap", "stream", "read"], default="mmap",
+                            help="how to read the diagram: memory-map it, stream it line by line "
+                                 "and emit classes as they complete, or read it whole (default: %(default)s)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="worker processes for files with several @startuml blocks or for a "
+                                 "directory; 0 means one per CPU (default: 1 for a file, 0 for a "
+                                 "directory; ignored with --input stream)")
+    arg_parser.add_argument("--cache-dir",
+                            help="directory of a parse cache shared between runs; unchanged diagram "
+                                 "blocks are loaded from it instead of parsed (not used with --input stream)")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                            help="size limit of the parse cache in MiB (default: %(default)s)")
+    arg_parser.add_argument("--force", action="store_true",
+                            help="rewrite every Java file, even those the output manifest shows are up to date")
+    arg_parser.add_argument("--quarantine", metavar="DIR",
+                            help="move generated files of classes that were removed from the diagram "
+                                 "into DIR instead of deleting them")
+    arg_parser.add_argument("--templates", metavar="DIR",
+                            help="directory of Java templates overriding the built-in ones in templates/")
+    arg_parser.add_argument("--type-map", metavar="FILE",
+                            help="JSON object mapping type names to the packages they are imported from, "
+                                 "added to the built-in java.util/java.time/java.math table")
+    arg_parser.add_argument("--collection-capacity", type=int, default=DEFAULT_COLLECTION_CAPACITY, metavar="N",
+                            help="initial capacity of the lists generated for associations with an unbounded "
+                                 "multiplicity such as 0..* (default: %(default)s)")
+    arg_parser.add_argument("--primitive-collections", choices=PRIMITIVE_COLLECTION_MODES, default="array",
+                            help="how collections of primitives such as List<int> are generated: primitive "
+                                 "arrays, fastutil collections or boxed collections (default: %(default)s)")
+    arg_parser.add_argument("--value-classes", action="store_true",
+                            help="generate every class that neither extends nor is extended by another one as an "
+                                 "immutable value class, not only those marked <<value>> or <<record>>")
+    arg_parser.add_argument("--value-style", choices=VALUE_STYLES, default="final",
+                            help="generate value classes as final classes with a cached hashCode or as Java "
+                                 "records (default: %(default)s)")
+    arg_parser.add_argument("--builders", choices=BUILDER_MODES, default="off",
+                            help="give every class a nested Builder and a static builder() factory; 'pooled' "
+                                 "reuses one builder per class and thread (default: %(default)s)")
+    arg_parser.add_argument("--archive", metavar="FILE",
+                            help="stream all Java files into one zip/jar/tar archive instead of the output "
+                                 "directory, a zip/jar laid out by package; '-' writes it to stdout")
+    arg_parser.add_argument("--archive-format", choices=ARCHIVE_FORMATS,
+                            help="archive format (default: from the --archive extension; tar for stdout)")
+    arg_parser.add_argument("--write-threads", type=int, default=1,
+                            help="threads writing Java files within each diagram; helps on "
+                                 "network or otherwise high-latency filesystems (default: %(default)s)")
+    args = arg_parser.parse_args()
+    if args.archive and args.archive != "-" and not args.archive_format and not archive_format(args.archive):
+        arg_parser.error(f"cannot infer the archive format of {args.archive}; use --archive-format")
+    plantuml_file_path = args.plantuml_file
+    cache = ParseCache(args.cache_dir, args.cache_size * 2**20) if args.cache_dir else None
 
     # Create a dummy PlantUML file for demonstration if it doesn't exist
     if not os.path.exists(plantuml_file_path):
@@ -303,9 +1414,34 @@ Professor .> Course
         with open(plantuml_file_path, "w") as f:
             f.write(sample_plantuml_content)
 
-    with open(plantuml_file_path, "r") as f:
-        plantuml_diagram = f.read()
-
-    generate_java_code_from_plantuml(plantuml_diagram)
-    print("\nCode generation complete. Check the 'generated_java' directory.")
-
+    type_packages = None
+    if args.type_map:
+        with open(args.type_map) as f:
+            type_packages = {**JAVA_TYPE_PACKAGES, **json.load(f)}
+    java_options = JavaOptions(collection_capacity=args.collection_capacity,
+                               primitive_collections=args.primitive_collections,
+                               value_classes=args.value_classes, value_style=args.value_style,
+                               builders=args.builders)
+    generator = Generator(args.templates, cache, args.jobs, args.write_threads, args.force, args.quarantine,
+                          type_packages, java_options)
+    try:
+        if args.archive == "-":
+            generator.write_archive(plantuml_file_path, sys.stdout.buffer, args.archive_format or "tar")
+            sys.stdout.buffer.flush()
+        elif args.archive:
+            n_files = generator.write_archive(plantuml_file_path, args.archive, args.archive_format)
+            print(f"Wrote {n_files} Java files to {args.archive}")
+        elif os.path.isdir(plantuml_file_path):
+            generator.generate_tree(plantuml_file_path, args.output_dir)
+        elif args.input == "stream":
+            with open(plantuml_file_path, "r") as f:
+                generator.generate_stream(f, args.output_dir)
+        elif args.input == "mmap":
+            generator.generate_file(plantuml_file_path, args.output_dir)
+        else:
+            with open(plantuml_file_path, "r") as f:
+                generator.generate(f.read(), args.output_dir)
+    except (InheritanceCycleError, ValueClassError, DiagramPathError, DuplicateEntryError) as e:
+        sys.exit(f"error: {e}")
+    if not args.archive:
+        print(f"\nCode generation complete. Check the '{args.output_dir}' directory.")
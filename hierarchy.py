@@ -0,0 +1,213 @@
+"""
+Inheritance closures of a parsed diagram.
+
+A `Hierarchy` answers, for any class of an `ir.Diagram`, which classes it
+inherits from, which attributes it inherits, all the way up its
+superclass chain, and which abstract methods (from its interfaces, their
+super-interfaces and its abstract ancestors) it still has to implement.
+Each chain is walked once: a class's closure is built from its parent's
+and its interfaces' memoized closures, so resolving every class of a
+diagram costs time linear in the number of classes (plus the size of the
+answers) rather than the sum of their depths. Classes are resolved on
+first use, so rendering a single class only walks its own chain.
+"""
+import ir
+
+
+class InheritanceCycleError(ValueError):
+    """A class that is, through its superclass chain, its own ancestor."""
+
+    def __init__(self, cycle):
+        super().__init__(f"inheritance cycle: {' -> '.join(cycle)}")
+        self.cycle = cycle
+
+    def __reduce__(self): # Rebuilt from the cycle when raised in a worker process
+        return type(self), (self.cycle,)
+
+
+def method_signature(method):
+    """Returns what identifies a method for overriding: its name and parameter types."""
+    return method.name, tuple(parameter.type for parameter in method.parameters)
+
+
+class Hierarchy:
+    """
+    Memoized superclass closures of an `ir.Diagram`, queried by the keys of
+    `diagram.classes` (qualified names). Create one per diagram state and
+    query it for as many classes as needed; it does not follow later
+    changes to the diagram. Siblings share the tuples returned for them, so
+    a class with 10k subclasses costs its closure once, not 10k times.
+    Threads may query one Hierarchy concurrently: a memo entry is stored
+    only once complete and never changed, so a race at worst repeats work.
+
+    Raises:
+        InheritanceCycleError: From a query reaching a class whose
+            superclass chain loops back on itself.
+    """
+
+    def __init__(self, diagram):
+        self.classes = diagram.classes
+        self._lineages = {} # name -> (root, ..., parent, class) ClassDecls
+        self._passed = {} # name -> attributes its subclasses inherit: its inherited ones, then its own
+        self._interface_methods = {} # interface name -> {signature: (interface, MethodDecl)}
+        self._contracts = {} # class name -> {signature: (owner, MethodDecl, implemented)}
+        self._passed_contracts = {} # class name -> the contract its subclasses start from
+
+    def _parent(self, name):
+        parent = self.classes[name].superclass
+        return parent if parent in self.classes else None
+
+    def _lineage(self, name):
+        memo = self._lineages
+        lineage = memo.get(name)
+        if lineage is not None:
+            return lineage
+        # Walk up to the first class whose lineage is known (or past a root),
+        # then fill in the lineages on the way back down, parents first.
+        path = []
+        on_path = {}
+        current = name
+        while current is not None and current not in memo:
+            if current in on_path:
+                raise InheritanceCycleError(path[on_path[current]:] + [current])
+            on_path[current] = len(path)
+            path.append(current)
+            current = self._parent(current)
+        lineage = memo[current] if current is not None else ()
+        for child in reversed(path):
+            lineage = memo[child] = lineage + (self.classes[child],)
+        return lineage
+
+    def ancestors(self, name):
+        """
+        Returns the ClassDecls of every superclass of class `name` that is
+        part of the diagram, from the root of its hierarchy down to its
+        parent.
+        """
+        parent = self._parent(name)
+        return self._lineage(parent) if parent is not None else ()
+
+    def inherited_attributes(self, name):
+        """
+        Returns the instance attributes class `name` inherits from its
+        superclasses, root first, in the order its constructor passes them
+        to super(). Interfaces and static attributes contribute none.
+        """
+        parent = self._parent(name)
+        return self._passed_down(parent) if parent is not None else ()
+
+    def _passed_down(self, name):
+        memo = self._passed
+        attributes = memo.get(name)
+        if attributes is not None:
+            return attributes
+        # Extend the attributes of the nearest class down the lineage that has them
+        lineage = self._lineage(name)
+        start = len(lineage)
+        while start and lineage[start - 1].qualified_name not in memo:
+            start -= 1
+        attributes = memo[lineage[start - 1].qualified_name] if start else ()
+        for decl in lineage[start:]:
+            if not decl.is_interface:
+                attributes += tuple(attr for attr in decl.attributes if not attr.is_static)
+            memo[decl.qualified_name] = attributes
+        return attributes
+
+    def _super_interfaces(self, name):
+        return [name for name in self.classes[name].interfaces
+                if name in self.classes and self.classes[name].is_interface]
+
+    def interface_methods(self, name):
+        """
+        Returns {signature: (declaring interface, MethodDecl)} of every
+        abstract method of interface `name`: its own and those of all its
+        super-interfaces, each interface's methods collected once.
+        """
+        memo = self._interface_methods
+        methods = memo.get(name)
+        if methods is not None:
+            return methods
+        # Depth-first over the super-interfaces, finishing each one after its parents
+        path = [name]
+        on_path = {name: 0}
+        pending = [iter(self._super_interfaces(name))]
+        while pending:
+            for parent in pending[-1]:
+                if parent in memo:
+                    continue
+                if parent in on_path:
+                    raise InheritanceCycleError(path[on_path[parent]:] + [parent])
+                on_path[parent] = len(path)
+                path.append(parent)
+                pending.append(iter(self._super_interfaces(parent)))
+                break
+            else:
+                pending.pop()
+                current = path.pop()
+                del on_path[current]
+                decl = self.classes[current]
+                methods = {}
+                for parent in self._super_interfaces(current):
+                    methods.update(memo[parent])
+                for method in decl.methods:
+                    if not method.is_static:
+                        methods[method_signature(method)] = (decl, method)
+                memo[current] = methods
+        return memo[name]
+
+    def _contract(self, name):
+        """
+        Returns {signature: (owner, MethodDecl, implemented)} of every
+        instance method class `name` declares, inherits or has to implement.
+        """
+        memo = self._contracts
+        contract = memo.get(name)
+        if contract is not None:
+            return contract
+        lineage = self._lineage(name)
+        start = len(lineage)
+        while start and lineage[start - 1].qualified_name not in memo:
+            start -= 1
+        for index in range(start, len(lineage)):
+            decl = lineage[index]
+            contract = self._passed_contract(lineage[index - 1]) if index else {}
+            if decl.interfaces or decl.methods:
+                contract = dict(contract)
+                for interface in decl.interfaces:
+                    if interface in self.classes and self.classes[interface].is_interface:
+                        for signature, (owner, method) in self.interface_methods(interface).items():
+                            contract.setdefault(signature, (owner, method, False))
+                for method in decl.methods:
+                    if not method.is_static:
+                        implemented = not (decl.is_interface or decl.kind == ir.ABSTRACT_CLASS and method.is_abstract)
+                        contract[method_signature(method)] = (decl, method, implemented)
+            memo[decl.qualified_name] = contract
+        return contract
+
+    def _passed_contract(self, decl):
+        """
+        Returns the contract the subclasses of `decl` start from: that of
+        decl, where a concrete class implements, with the stubs it gets,
+        every method it was missing.
+        """
+        key = decl.qualified_name
+        contract = self._passed_contracts.get(key)
+        if contract is None:
+            contract = self._contracts[key]
+            if decl.kind == ir.CLASS and not all(implemented for _, _, implemented in contract.values()):
+                contract = {signature: (owner, method, True) for signature, (owner, method, _) in contract.items()}
+            self._passed_contracts[key] = contract
+        return contract
+
+    def missing_methods(self, name):
+        """
+        Returns (owner, MethodDecl) for each abstract method that concrete
+        class `name` inherits, from its interfaces (transitively) or its
+        abstract ancestors, and neither it nor an ancestor implements; owner
+        is the interface or abstract class declaring it. A concrete ancestor
+        implements, with its own stubs, all it was missing. Interfaces and
+        abstract classes have nothing missing.
+        """
+        if self.classes[name].kind != ir.CLASS:
+            return []
+        return [(owner, method) for owner, method, implemented in self._contract(name).values() if not implemented]
@@ -0,0 +1,234 @@
+"""
+Intermediate representation of a parsed PlantUML class diagram.
+
+The parser (`parser.parse_plantuml`) produces a `Diagram`; every backend
+(the Java emitter and anything built on top of it) consumes one. All nodes
+are slotted dataclasses, so a diagram with hundreds of thousands of
+members stays compact and attribute access is a plain slot lookup.
+
+Names of types are interned with `intern_type`, so the many `String`,
+`int` and `Date` references in a large diagram share one string object.
+
+Layout:
+
+    Diagram
+      name           str or None, from `@startuml name`
+      title          str or None
+      classes        {qualified name: ClassDecl}, in declaration order; a
+                     class of the default package is keyed by its name
+      relationships  [Relationship], in source order
+      graph          RelationshipGraph indexing the relationships by class
+
+    ClassDecl
+      name, kind ('class', 'abstract_class' or 'interface')
+      package        dotted Java package from the enclosing package/namespace
+                     blocks or a qualified name ('' for the default package)
+      attributes     [AttributeDecl]
+      methods        [MethodDecl] -> parameters [Parameter]
+      superclass     key in `classes` of the parent class, or None
+      interfaces     [key of each implemented interface, or of each
+                     interface an interface extends]
+      references     [each type name its members mention, once, in source order]
+      stereotypes    [name of each <<stereotype>> of the declaration, e.g. 'value']
+
+    Relationship
+      source, target keys of the two classes, oriented by meaning rather
+                     than by how the arrow was drawn: the child for
+                     EXTENDS/IMPLEMENTS, the whole for AGGREGATION/COMPOSITION,
+                     the tail of a navigable ASSOCIATION or a DEPENDENCY
+      kind, arrow    one of the kinds below, and the arrow as written
+      label          text after ':', without its '<'/'>' reading direction
+      source_multiplicity, target_multiplicity
+                     e.g. '1' and '0..*', or ''
+
+Visibilities are stored as Java modifiers ('public', 'private',
+'protected', or '' for package-private).
+"""
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+CLASS = 'class'
+ABSTRACT_CLASS = 'abstract_class'
+INTERFACE = 'interface'
+
+# Relationship kinds
+EXTENDS = 'extends'
+IMPLEMENTS = 'implements'
+ASSOCIATION = 'association'
+AGGREGATION = 'aggregation'
+COMPOSITION = 'composition'
+DEPENDENCY = 'dependency'
+
+intern_type = sys.intern
+
+_TYPE_NAME = re.compile(r'[A-Za-z_]\w*(?:\.\w+)*')
+
+
+@dataclass(slots=True)
+class Parameter:
+    name: str
+    type: str  # Empty when the diagram gives no type
+
+
+@dataclass(slots=True)
+class AttributeDecl:
+    name: str
+    type: str
+    visibility: str
+    is_static: bool = False
+
+
+@dataclass(slots=True)
+class MethodDecl:
+    name: str
+    return_type: str
+    parameters: List[Parameter] = field(default_factory=list)
+    visibility: str = 'public'
+    is_static: bool = False
+    is_abstract: bool = False
+
+
+@dataclass(slots=True)
+class ClassDecl:
+    name: str
+    kind: str = CLASS
+    attributes: List[AttributeDecl] = field(default_factory=list)
+    methods: List[MethodDecl] = field(default_factory=list)
+    superclass: Optional[str] = None
+    interfaces: List[str] = field(default_factory=list)
+    package: str = ''
+    references: List[str] = field(default_factory=list)
+    stereotypes: List[str] = field(default_factory=list)
+
+    @property
+    def is_interface(self):
+        return self.kind == INTERFACE
+
+    @property
+    def qualified_name(self):
+        return f"{self.package}.{self.name}" if self.package else self.name
+
+    def referenced_types(self):
+        """Returns the set of type names this class mentions: parents and member, parameter and return types."""
+        names = set(self.references)
+        names.update(self.interfaces)
+        if self.superclass:
+            names.add(self.superclass)
+        return names
+
+
+def type_names(type_text):
+    """Returns the type names in a type as written, e.g. ['Map', 'String', 'List', 'Course']."""
+    return _TYPE_NAME.findall(type_text)
+
+
+def method_type_names(method):
+    """Returns the type names in a method's return and parameter types."""
+    names = type_names(method.return_type)
+    for parameter in method.parameters:
+        names += type_names(parameter.type)
+    return names
+
+
+@dataclass(slots=True)
+class Relationship:
+    source: str
+    target: str
+    kind: str  # EXTENDS, IMPLEMENTS, ASSOCIATION, AGGREGATION, COMPOSITION or DEPENDENCY
+    arrow: str  # The arrow as written in the diagram, e.g. '<|--'
+    label: str = ''
+    source_multiplicity: str = ''
+    target_multiplicity: str = ''
+
+
+class RelationshipGraph:
+    """
+    Adjacency lists of a diagram's relationships, in both directions: the
+    relationships leaving each class (it is their source) and those arriving
+    at it (it is their target), each in source order. Lookups cost O(1) plus
+    the size of the answer.
+    """
+    __slots__ = ('_outgoing', '_incoming')
+
+    def __init__(self, relationships=()):
+        self._outgoing = {}
+        self._incoming = {}
+        for relationship in relationships:
+            self.add(relationship)
+
+    def add(self, relationship):
+        self._outgoing.setdefault(relationship.source, []).append(relationship)
+        self._incoming.setdefault(relationship.target, []).append(relationship)
+
+    def outgoing(self, name, *kinds):
+        """Returns the relationships whose source is class `name`, only those of the given kinds if any."""
+        edges = self._outgoing.get(name, [])
+        return [edge for edge in edges if edge.kind in kinds] if kinds else list(edges)
+
+    def incoming(self, name, *kinds):
+        """Returns the relationships whose target is class `name`, only those of the given kinds if any."""
+        edges = self._incoming.get(name, [])
+        return [edge for edge in edges if edge.kind in kinds] if kinds else list(edges)
+
+    def targets(self, name, *kinds):
+        """Returns the names of the classes `name` points to, e.g. targets('Student', EXTENDS)."""
+        return [edge.target for edge in self.outgoing(name, *kinds)]
+
+    def sources(self, name, *kinds):
+        """Returns the names of the classes pointing to `name`, e.g. sources('Person', EXTENDS) for its children."""
+        return [edge.source for edge in self.incoming(name, *kinds)]
+
+    def __iter__(self):
+        for edges in self._outgoing.values():
+            yield from edges
+
+    def __len__(self):
+        return sum(map(len, self._outgoing.values()))
+
+    def __getstate__(self):
+        return self._outgoing, self._incoming
+
+    def __setstate__(self, state):
+        self._outgoing, self._incoming = state
+
+
+@dataclass(slots=True)
+class Diagram:
+    name: Optional[str] = None
+    title: Optional[str] = None
+    classes: Dict[str, ClassDecl] = field(default_factory=dict)
+    relationships: List[Relationship] = field(default_factory=list)
+    graph: RelationshipGraph = field(default_factory=RelationshipGraph, repr=False, compare=False)
+    simple_names: Dict[str, List[str]] = field(default_factory=dict, repr=False, compare=False)
+
+    def add_class(self, decl):
+        """Adds a class under its qualified name, replacing any class of that name."""
+        key = decl.qualified_name
+        if key not in self.classes:
+            self.simple_names.setdefault(decl.name, []).append(key)
+        self.classes[key] = decl
+
+    def resolve(self, name, package=''):
+        """
+        Returns the key in `classes` of the class that type name `name`
+        refers to from code in `package`: a class of that package, else the
+        class of that qualified name (or of that name in the default
+        package), else the only class of the diagram with that simple name,
+        which the code imports. None when there is no such class or the
+        simple name is ambiguous.
+        """
+        if package:
+            key = f"{package}.{name}"
+            if key in self.classes:
+                return key
+        if name in self.classes:
+            return name
+        keys = self.simple_names.get(name)
+        return keys[0] if keys is not None and len(keys) == 1 else None
+
+    def add_relationship(self, relationship):
+        """Appends a relationship to the diagram and to its graph index."""
+        self.relationships.append(relationship)
+        self.graph.add(relationship)
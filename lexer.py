@@ -0,0 +1,148 @@
+"""
+Single-pass tokenizer for PlantUML class diagrams.
+
+`tokenize` walks the diagram text once, left to right, using one compiled
+master pattern, and yields typed `Token` tuples. Every later phase
+(declarations, members, relationships) consumes this token stream instead
+of re-scanning the source with its own regular expression.
+"""
+import re
+from typing import Iterator, NamedTuple, Optional
+
+# Token kinds
+KEYWORD = 'KEYWORD'
+IDENT = 'IDENT'
+LBRACE = 'LBRACE'
+RBRACE = 'RBRACE'
+LPAREN = 'LPAREN'
+RPAREN = 'RPAREN'
+COLON = 'COLON'
+COMMA = 'COMMA'
+ARROW = 'ARROW'
+VISIBILITY = 'VISIBILITY'
+MODIFIER = 'MODIFIER'
+STEREOTYPE = 'STEREOTYPE'
+STRING = 'STRING'
+COMMENT = 'COMMENT'
+DIRECTIVE = 'DIRECTIVE'
+NEWLINE = 'NEWLINE'
+SYMBOL = 'SYMBOL'
+
+KEYWORDS = frozenset({
+    'abstract', 'class', 'interface', 'enum', 'package', 'namespace',
+    'title', 'skinparam', 'hide', 'show', 'note', 'end',
+})
+
+# Arrow heads that may appear on either end of a relationship line.
+_HEAD = (r'(?:\}o|\}\||\|o|o\||\|\||o\{|\|\{|<\||\|>|<|>|\*|\#|\+|\^|\{|\}'
+         r'|[ox](?=--|\.\.)|(?<=[-.])[ox](?!\w))')
+_BODY = r'(?:-+|\.+)'
+_HINT = r'(?:\[[^\[\]\n]*\]|up|down|left|right|[udlr])'
+
+# Order matters: earlier alternatives win at the same position.
+#
+# Every pattern must match in time linear in the text it consumes, and an
+# attempt that fails must stop at a character that cannot start the same
+# pattern again (e.g. stereotypes and arrow hints stop at the next '<' or
+# '['), so that tokenizing is linear even on adversarial input. An
+# unterminated block comment runs to the end of the text.
+_TOKEN_SPEC = [
+    ('BLOCK_COMMENT', r"/'[\s\S]*?(?:'/|\Z)"),
+    (COMMENT, r"^[ \t]*'[^\n]*"),
+    (VISIBILITY, r'^[ \t]*[+\-#~](?=[ \t]*[\w{])'),
+    (NEWLINE, r'\n'),
+    ('WS', r'[ \t\r\f\v]+'),
+    (STRING, r'"[^"\n]*"'),
+    (DIRECTIVE, r'@\w+'),
+    (MODIFIER, r'\{(?:static|abstract|classifier|field|method)\}'),
+    (STEREOTYPE, r'<<[^<>\n]*>>'),
+    (ARROW, rf'{_HEAD}?{_BODY}(?:{_HINT}{_BODY})?{_HEAD}?'),
+    (IDENT, r'\w+(?:\.\w+)*'),
+    (LBRACE, r'\{'),
+    (RBRACE, r'\}'),
+    (LPAREN, r'\('),
+    (RPAREN, r'\)'),
+    (COLON, r':'),
+    (COMMA, r','),
+    (SYMBOL, r'\S'),
+]
+
+_MASTER_PATTERN = '|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in _TOKEN_SPEC)
+_MASTER = re.compile(_MASTER_PATTERN, re.MULTILINE)
+# Same grammar over bytes-like buffers (bytes, memoryview, mmap). \w is ASCII-only
+# there, so every byte of a UTF-8 multibyte sequence also counts as a word
+# character: non-ASCII identifiers such as Größe stay one IDENT, and no
+# character is ever split into SYMBOL tokens that cannot be decoded.
+_WORD_BYTES = r'\w\x80-\xff'
+_MASTER_BYTES = re.compile(
+    re.sub(r'(?<!\[)\\w', lambda _: f'[{_WORD_BYTES}]',
+           _MASTER_PATTERN.replace(r'[\w', f'[{_WORD_BYTES}')).encode(),
+    re.MULTILINE)
+_INDENT = re.compile(r'[ \t]*')
+_INDENT_BYTES = re.compile(rb'[ \t]*')
+_MAX_KEYWORD_LEN = max(map(len, KEYWORDS))
+
+
+class Token(NamedTuple):
+    kind: str
+    value: Optional[str]  # None for tokens produced in span mode
+    start: int  # offset of the first character in the source buffer
+    end: int    # offset one past the last character
+    line: int
+
+
+def token_text(source, start, end):
+    """
+    Returns source[start:end] as a str, decoding UTF-8 for bytes-like sources.
+    """
+    if isinstance(source, str):
+        return source[start:end]
+    return str(source[start:end], 'utf-8')
+
+
+def tokenize(source, spans=False) -> Iterator[Token]:
+    """
+    Yields the tokens of `source` in source order.
+
+    Whitespace is dropped; newlines are kept as NEWLINE tokens because
+    PlantUML is line oriented. Identifiers that are PlantUML keywords are
+    reported as KEYWORD tokens.
+
+    Args:
+        source: The diagram text, as a str or as a bytes-like buffer holding
+            UTF-8 (bytes, memoryview, or an mmap of the file).
+        spans (bool): If True, tokens only carry their (start, end) offsets
+            and `value` is None; callers slice the text they need with
+            `token_text`. Nothing is copied out of the buffer for comments,
+            strings or punctuation.
+    """
+    is_text = isinstance(source, str)
+    master, indent = (_MASTER, _INDENT) if is_text else (_MASTER_BYTES, _INDENT_BYTES)
+    keywords = KEYWORDS if is_text else frozenset(k.encode() for k in KEYWORDS)
+    line = 1
+    for match in master.finditer(source):
+        kind = match.lastgroup
+        if kind == 'WS':
+            continue
+        start, end = match.span()
+        if kind == NEWLINE:
+            yield Token(NEWLINE, None if spans else '\n', start, end, line)
+            line += 1
+            continue
+        if kind == IDENT:
+            if end - start <= _MAX_KEYWORD_LEN and match.group() in keywords:
+                kind = KEYWORD
+        elif kind == VISIBILITY or kind == COMMENT:
+            # Both may swallow the indentation in front of them.
+            start = indent.match(source, start).end()
+        if spans:
+            value = None
+        elif is_text:
+            value = source[start:end]
+        else:
+            value = str(source[start:end], 'utf-8')
+        if kind == 'BLOCK_COMMENT':
+            yield Token(COMMENT, value, start, end, line)
+            line += match.group().count('\n' if is_text else b'\n')
+        else:
+            yield Token(kind, value, start, end, line)
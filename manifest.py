@@ -0,0 +1,185 @@
+"""
+Per-output-directory manifest of generated files, for incremental runs.
+
+The manifest maps each generated class to its file and to a hash of
+everything its Java source is rendered from: the class's own IR, the IR
+it depends on (the inherited attributes that go into its constructor, the
+inherited abstract methods it gets stubs for, the relationships it is the
+source of, whether it has subclasses and the packages of the classes it
+imports) and the templates. A class whose hash matches the manifest, and
+whose file is still there, is not rendered or written again; a class
+recorded in the manifest that is gone from the diagram has its file
+pruned.
+"""
+import hashlib
+import json
+import os
+
+import ir
+from cache import GENERATOR_VERSION
+from hierarchy import Hierarchy
+from output import atomic_write, remove_empty_dirs, write_if_changed
+
+MANIFEST_NAME = '.plantuml-manifest.json'
+MANIFEST_VERSION = 2
+
+
+def class_digest(diagram, decl, template_key=None, hierarchy=None):
+    """
+    Returns the hash of a class's IR and of the IR its generated file depends
+    on. template_key identifies the templates the file is rendered with, so
+    that editing them invalidates every class. Pass the diagram's
+    `hierarchy.Hierarchy` when hashing many classes.
+    """
+    classes = diagram.classes
+    hierarchy = hierarchy if hierarchy is not None else Hierarchy(diagram)
+    digest = hashlib.sha1(GENERATOR_VERSION.encode())
+    if template_key:
+        digest.update(template_key.encode())
+    digest.update(repr(decl).encode())
+    key = decl.qualified_name
+    inherited = hierarchy.inherited_attributes(key)
+    digest.update(repr(inherited).encode())
+    missing = hierarchy.missing_methods(key)
+    digest.update(repr([(owner.kind, method) for owner, method in missing]).encode())
+    outgoing = diagram.graph.outgoing(key)
+    digest.update(repr(outgoing).encode())
+    # Whether it has subclasses, which keeps it from being generated as a value class
+    digest.update(repr(bool(diagram.graph.sources(key, ir.EXTENDS))).encode())
+    # The classes the names it mentions resolve to, which decide its imports and how it names them
+    names = decl.referenced_types()
+    names.update(relationship.target for relationship in outgoing)
+    for attr in inherited:
+        names.update(ir.type_names(attr.type))
+    for _, method in missing:
+        names.update(ir.method_type_names(method))
+    resolved = []
+    for name in sorted(names):
+        other = classes.get(name)
+        if other is not None: # A class key, named by its simple name if that resolves to it
+            name = other.name
+        resolved.append(diagram.resolve(name.partition('.')[0], decl.package))
+    digest.update(repr(resolved).encode())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    The manifest of one output directory. `load` reads it (an empty one when
+    missing or unreadable); `save` writes it back atomically, and only when
+    something was recorded.
+    """
+
+    def __init__(self, output_dir, classes=None, trust_hashes=True):
+        self.output_dir = output_dir
+        self.classes = classes if classes is not None else {} # qualified name -> {'file': ..., 'hash': ...}
+        self.trust_hashes = trust_hashes
+        self.changed = False
+        self._moved = [] # Files of recorded classes that have since been written elsewhere
+
+    @classmethod
+    def load(cls, output_dir, trust_hashes=True):
+        """
+        Reads the manifest of output_dir. With trust_hashes=False every class
+        is treated as out of date, but the recorded files are still known, so
+        stale ones can be pruned.
+        """
+        try:
+            with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(output_dir, trust_hashes=trust_hashes)
+        if data.get('version') != MANIFEST_VERSION:
+            return cls(output_dir, trust_hashes=trust_hashes)
+        return cls(output_dir, data.get('classes', {}), trust_hashes)
+
+    def is_current(self, name, file_name, digest):
+        """True if name was last generated into file_name from IR hashing to digest and the file still exists."""
+        entry = self.classes.get(name)
+        return self.trust_hashes and entry is not None and entry['hash'] == digest and entry['file'] == file_name and \
+            os.path.exists(os.path.join(self.output_dir, file_name))
+
+    def record(self, name, file_name, digest):
+        entry = self.classes.get(name)
+        if entry is not None and entry['file'] != file_name: # Moved, e.g. to another package: prune the old file
+            self._moved.append(entry['file'])
+        self.classes[name] = {'file': file_name, 'hash': digest}
+        self.changed = True
+
+    def transfer(self, names, target):
+        """
+        Moves the files of the recorded classes `names` into the directory of
+        manifest `target` and records them there, merging with what target
+        already holds: a file there with the same content is left untouched.
+        The classes are dropped from this manifest, whose file is removed
+        once it records nothing.
+        """
+        for name in names:
+            entry = self.classes.pop(name, None)
+            if entry is None:
+                continue
+            self.changed = True
+            path = os.path.join(self.output_dir, entry['file'])
+            try:
+                with open(path, 'rb') as f:
+                    text = f.read().decode('utf-8')
+            except FileNotFoundError:
+                continue
+            target_path = os.path.join(target.output_dir, entry['file'])
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            write_if_changed(target_path, text)
+            target.record(name, entry['file'], entry['hash'])
+            os.unlink(path)
+            remove_empty_dirs(os.path.dirname(path), self.output_dir)
+        if self.classes:
+            self.save()
+        elif self.changed:
+            try:
+                os.unlink(os.path.join(self.output_dir, MANIFEST_NAME))
+            except FileNotFoundError:
+                pass
+            self.changed = False
+
+    def prune(self, live_names, quarantine_dir=None):
+        """
+        Removes the files of recorded classes that are not in live_names, i.e.
+        classes that disappeared from the diagram, and drops them from the
+        manifest, as well as the files classes were recorded in before they
+        moved to another one. Only files listed in the manifest are touched,
+        and never one a remaining class is recorded in. With a
+        quarantine_dir the files are moved there instead of being deleted.
+
+        Returns:
+            int: The number of files removed or quarantined.
+        """
+        removed = 0
+        stale = self._moved
+        self._moved = []
+        for name in [name for name in self.classes if name not in live_names]:
+            stale.append(self.classes.pop(name)['file'])
+            self.changed = True
+        live_files = {entry['file'] for entry in self.classes.values()}
+        for file_name in stale:
+            if file_name in live_files:
+                continue
+            path = os.path.join(self.output_dir, file_name)
+            try:
+                if quarantine_dir is None:
+                    os.unlink(path)
+                else:
+                    target = os.path.join(quarantine_dir, file_name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            remove_empty_dirs(os.path.dirname(path), self.output_dir) # Drop emptied package directories
+        return removed
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        data = json.dumps({'version': MANIFEST_VERSION, 'classes': self.classes}, indent=1, sort_keys=True)
+        atomic_write(os.path.join(self.output_dir, MANIFEST_NAME), data)
+        self.changed = False
@@ -0,0 +1,183 @@
+"""
+Safe emission of generated files.
+
+Files are rendered in memory and only written when their content differs
+from what is on disk, so unchanged outputs keep their mtime and do not
+trigger downstream rebuilds. Writes go to a temporary file in the same
+directory that is then renamed over the target, so readers never see a
+half-written file.
+
+Alternatively, `write_archive` streams all generated files into one zip,
+jar or tar archive, for outputs too large to be worth thousands of files.
+"""
+import io
+import os
+import tarfile
+import zipfile
+from dataclasses import dataclass
+
+_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+
+class DuplicateEntryError(ValueError):
+    """Two files streamed into an archive under the same path."""
+
+    def __init__(self, path):
+        super().__init__(f"duplicate archive entry: {path}")
+        self.path = path
+
+
+@dataclass(slots=True)
+class WriteStats:
+    """Counts of what an emission run did to the output tree."""
+    written: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+    def __add__(self, other):
+        return WriteStats(self.written + other.written, self.unchanged + other.unchanged,
+                          self.deleted + other.deleted)
+
+    def __str__(self):
+        return f"{self.written} written, {self.unchanged} unchanged, {self.deleted} deleted"
+
+
+def atomic_write(path, data):
+    """
+    Writes data (bytes or str, encoded as UTF-8) to path through a temporary
+    file and a rename. The temporary file is created with the usual umask
+    applied, like a file opened with open(path, 'w').
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    directory, base = os.path.split(path)
+    while True:
+        tmp_path = os.path.join(directory, f".{base}.{os.urandom(4).hex()}.tmp")
+        try:
+            fd = os.open(tmp_path, _OPEN_FLAGS, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_if_changed(path, text):
+    """
+    Atomically writes text to path unless the file already holds exactly
+    that content. Returns True if the file was written.
+    """
+    data = text.encode('utf-8')
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    atomic_write(path, data)
+    return True
+
+
+def remove_empty_dirs(directory, root):
+    """Removes directory and then its parents, up to but excluding root, for as long as they are empty."""
+    root = os.path.abspath(root)
+    directory = os.path.abspath(directory)
+    while directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+ARCHIVE_FORMATS = ('zip', 'jar', 'tar', 'tar.gz')
+
+# Fixed timestamp of archive entries, so the same sources give a byte-identical archive
+_ARCHIVE_DATE = (1980, 1, 1, 0, 0, 0)
+_JAR_MANIFEST = "Manifest-Version: 1.0\nCreated-By: generate_code.py\n\n"
+
+
+def archive_format(path):
+    """Returns the archive format implied by a file name's extension, or None."""
+    name = path.lower()
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    extension = os.path.splitext(name)[1][1:]
+    return extension if extension in ARCHIVE_FORMATS else None
+
+
+def write_archive(entries, target, fmt):
+    """
+    Streams generated files into a single zip/jar or tar archive in one
+    sequential pass: each entry is compressed and appended as it is produced,
+    and nothing else is written to disk.
+
+    Args:
+        entries: Iterable of (path, text) pairs; paths are '/'-separated.
+        target: Path of the archive, or a writable binary file object (which
+            need not be seekable, e.g. sys.stdout.buffer). A path is written
+            through a temporary file and renamed into place.
+        fmt (str): One of ARCHIVE_FORMATS. A jar is a zip with a
+            META-INF/MANIFEST.MF first.
+
+    Returns:
+        int: The number of entries written (not counting the jar manifest).
+
+    Raises:
+        DuplicateEntryError: If two entries have the same path; an archive
+            written to a path is then not created.
+    """
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"unknown archive format {fmt!r}; expected one of {', '.join(ARCHIVE_FORMATS)}")
+    if not isinstance(target, (str, os.PathLike)):
+        return _write_archive_stream(entries, target, fmt)
+    directory, base = os.path.split(os.fspath(target))
+    tmp_path = os.path.join(directory, f".{base}.{os.urandom(4).hex()}.tmp")
+    try:
+        with open(tmp_path, 'xb') as f:
+            count = _write_archive_stream(entries, f, fmt)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return count
+
+
+def _unique_entries(entries, reserved=()):
+    seen = set(reserved)
+    for path, text in entries:
+        if path in seen:
+            raise DuplicateEntryError(path)
+        seen.add(path)
+        yield path, text
+
+
+def _write_archive_stream(entries, stream, fmt):
+    count = 0
+    entries = _unique_entries(entries, ['META-INF/MANIFEST.MF'] if fmt == 'jar' else ())
+    if fmt in ('zip', 'jar'):
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            if fmt == 'jar':
+                archive.writestr(zipfile.ZipInfo('META-INF/MANIFEST.MF', _ARCHIVE_DATE), _JAR_MANIFEST,
+                                 zipfile.ZIP_DEFLATED)
+            for path, text in entries:
+                archive.writestr(zipfile.ZipInfo(path, _ARCHIVE_DATE), text.encode('utf-8'), zipfile.ZIP_DEFLATED)
+                count += 1
+    else:
+        with tarfile.open(fileobj=stream, mode='w|gz' if fmt == 'tar.gz' else 'w|',
+                          format=tarfile.PAX_FORMAT) as archive:
+            for path, text in entries:
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(data))
+                count += 1
+    return count
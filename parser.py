@@ -0,0 +1,557 @@
+"""
+Parser turning the `lexer` token stream into the `ir` representation.
+"""
+import mmap
+import os
+import re
+from contextlib import contextmanager
+
+import ir
+import lexer
+from ir import intern_type
+from lexer import token_text
+
+# PlantUML visibility markers and their Java modifiers
+VISIBILITY_MAP = {
+    '+': 'public',
+    '-': 'private',
+    '#': 'protected',
+    '~': '' # Package-private, default in Java
+}
+
+
+def _split_lines(tokens):
+    """Groups a token stream into lists of tokens, one list per source line."""
+    line = []
+    for tok in tokens:
+        if tok.kind == lexer.NEWLINE:
+            yield line
+            line = []
+        elif tok.kind != lexer.COMMENT:
+            line.append(tok)
+    yield line
+
+
+def _value(source, tok):
+    """Returns the text of a token, slicing it out of the source for span-mode tokens."""
+    value = tok.value
+    return value if value is not None else token_text(source, tok.start, tok.end)
+
+
+def _type_text(source, toks, refs=None):
+    """
+    Returns the interned source text covered by a run of type tokens (keeps
+    generics intact). The type names in it are appended to refs, if given.
+    """
+    if refs is not None:
+        refs.extend(_value(source, tok) for tok in toks if tok.kind == lexer.IDENT)
+    return intern_type(token_text(source, toks[0].start, toks[-1].end)) if toks else ''
+
+
+def _parse_member(source, toks, refs=None):
+    """
+    Parses the tokens of one class body line into an AttributeDecl or a
+    MethodDecl. Returns None if the line is not a member. The type names the
+    member mentions are appended to refs, if given.
+    """
+    if not toks or toks[0].kind != lexer.VISIBILITY:
+        return None
+    java_visibility = VISIBILITY_MAP.get(_value(source, toks[0]), 'public') # Default to public if unknown
+
+    i = 1
+    modifiers = set()
+    while i < len(toks) and toks[i].kind == lexer.MODIFIER:
+        modifiers.add(_value(source, toks[i]))
+        i += 1
+    if i >= len(toks) or toks[i].kind not in (lexer.IDENT, lexer.KEYWORD):
+        return None
+    member_name = intern_type(_value(source, toks[i]))
+    is_static = '{static}' in modifiers or '{classifier}' in modifiers
+    rest = toks[i + 1:]
+
+    if rest and rest[0].kind == lexer.LPAREN: # It's a method
+        depth = 0
+        close = None
+        for j, tok in enumerate(rest):
+            if tok.kind == lexer.LPAREN:
+                depth += 1
+            elif tok.kind == lexer.RPAREN:
+                depth -= 1
+                if depth == 0:
+                    close = j
+                    break
+        if close is None:
+            return None
+        params = []
+        param_toks = []
+        angle = 0
+        for tok in rest[1:close] + [None]:
+            if tok is None or (tok.kind == lexer.COMMA and angle == 0):
+                if param_toks:
+                    params.append(_parse_parameter(source, param_toks, refs))
+                param_toks = []
+                continue
+            if tok.kind == lexer.SYMBOL:
+                symbol = _value(source, tok)
+                if symbol == '<':
+                    angle += 1
+                elif symbol == '>':
+                    angle -= 1
+            param_toks.append(tok)
+        tail = rest[close + 1:]
+        return_type = _type_text(source, tail[1:], refs) if tail and tail[0].kind == lexer.COLON else ''
+        return ir.MethodDecl(
+            name=member_name,
+            return_type=return_type if return_type else 'void',
+            parameters=params,
+            visibility=java_visibility,
+            is_static=is_static,
+            is_abstract='{abstract}' in modifiers,
+        )
+
+    attr_type = _type_text(source, rest[1:], refs) if rest and rest[0].kind == lexer.COLON else ''
+    return ir.AttributeDecl(
+        name=member_name,
+        type=attr_type, # Empty if not specified; see _infer_attribute_types
+        visibility=java_visibility,
+        is_static=is_static,
+    )
+
+
+def _parse_parameter(source, toks, refs=None):
+    """Parses the tokens of one `name: Type` parameter."""
+    for j, tok in enumerate(toks):
+        if tok.kind == lexer.COLON:
+            if j == 1 and j + 1 < len(toks):
+                return ir.Parameter(name=_value(source, toks[0]), type=_type_text(source, toks[j + 1:], refs))
+            break
+    return ir.Parameter(name=token_text(source, toks[0].start, toks[-1].end), type='') # Fallback for malformed params
+
+
+def _infer_attribute_types(decl):
+    """
+    Types the untyped attributes of a completed class from its accessors:
+    `- age` with `+ getAge(): int` or `+ setAge(age: int)` is an int. What
+    cannot be inferred is an Object.
+    """
+    untyped = [attr for attr in decl.attributes if not attr.type]
+    if not untyped:
+        return
+    accessor_types = {}
+    for method in decl.methods:
+        if method.name.startswith(('get', 'is')) and not method.parameters and method.return_type != 'void':
+            accessor_types.setdefault(method.name[3 if method.name[0] == 'g' else 2:], method.return_type)
+        elif method.name.startswith('set') and len(method.parameters) == 1 and method.parameters[0].type:
+            accessor_types.setdefault(method.name[3:], method.parameters[0].type)
+    for attr in untyped:
+        attr.type = accessor_types.get(attr.name[:1].upper() + attr.name[1:], 'Object')
+        for name in ir.type_names(attr.type):
+            if name not in decl.references:
+                decl.references.append(intern_type(name))
+
+
+def _ends_in_block_comment(text):
+    """
+    Returns whether text ends inside an unterminated /' block comment, as
+    the lexer reads it: a /' in a ' line comment or in a string opens none.
+    """
+    last = None
+    for last in lexer.tokenize(text):
+        pass
+    return last is not None and last.kind == lexer.COMMENT and last.value.startswith("/'") and \
+        (len(last.value) < 4 or not last.value.endswith("'/"))
+
+
+def _java_package(name):
+    """Turns a PlantUML package name into a valid dotted Java package name ('' if nothing is left)."""
+    parts = (re.sub(r'\W+', '_', part).strip('_') for part in name.split('.'))
+    return '.'.join(f"_{part}" if part[0].isdigit() else part for part in parts if part)
+
+
+def _class_key(diagram, name, package):
+    """Returns the key of the class a relationship line in `package` names, qualified or not (None if unknown)."""
+    scope, _, simple = name.rpartition('.')
+    if scope:
+        scope = _java_package(scope)
+        name = f"{scope}.{simple}" if scope else simple
+    return diagram.resolve(name, package)
+
+
+def _stereotypes(text):
+    """Returns the names in a `<<name>>` or `<< (S,#color) name, other >>` stereotype."""
+    text = re.sub(r'\([^)]*\)', '', text[2:-2]) # Drop the spot, e.g. (V,#FFCC00)
+    return [intern_type(name.strip()) for name in text.split(',') if name.strip()]
+
+
+def _scope_name(source, toks):
+    """Returns the Java package of a `package`/`namespace` header: `name`, `"Title" as name` or `"Title"`."""
+    for j, tok in enumerate(toks):
+        if tok.kind == lexer.IDENT and _value(source, tok) == 'as' and j + 1 < len(toks):
+            return _java_package(_value(source, toks[j + 1]))
+    if toks and toks[0].kind == lexer.IDENT:
+        return _java_package(_value(source, toks[0]))
+    if toks and toks[0].kind == lexer.STRING:
+        return _java_package(_value(source, toks[0])[1:-1])
+    return None
+
+
+# Arrow heads and what they make of a relationship: (heads, kind with a solid
+# line, kind with a dotted line, whether the end with the head is the
+# relationship's source). Earlier rows win when both ends have a head.
+_ARROW_HEADS = (
+    (('<|', '|>', '^'), ir.EXTENDS, ir.IMPLEMENTS, False),
+    (('*',), ir.COMPOSITION, ir.COMPOSITION, True),
+    (('o',), ir.AGGREGATION, ir.AGGREGATION, True),
+    (('<', '>'), ir.ASSOCIATION, ir.DEPENDENCY, False),
+)
+_LABEL_DIRECTION = re.compile(r'^<\s+|\s+>$|^[<>]$')
+
+
+def _relationship_kind(arrow):
+    """
+    Classifies an arrow as written (e.g. '<|--', '..|>', 'o--', '-up->',
+    '-[#red]->'). Returns (kind, forward), where forward tells whether the
+    operand on the left of the arrow is the relationship's source.
+    """
+    first = min(i for i in (arrow.find('-'), arrow.find('.')) if i >= 0)
+    last = max(arrow.rfind('-'), arrow.rfind('.')) # Direction hints sit between body characters
+    left, right = arrow[:first], arrow[last + 1:]
+    dotted = arrow[first] == '.'
+    for heads, solid_kind, dotted_kind, head_is_source in _ARROW_HEADS:
+        kind = dotted_kind if dotted else solid_kind
+        if right in heads:
+            return kind, not head_is_source
+        if left in heads:
+            return kind, head_is_source
+    return ir.DEPENDENCY if dotted else ir.ASSOCIATION, True
+
+
+def _parse_relationship(source, toks):
+    """
+    Parses a relationship line, `Left ["mult"] arrow ["mult"] Right [: label]`.
+    Returns (left, left multiplicity, arrow, right multiplicity, right,
+    label), or None if the line is not a relationship.
+    """
+    operands = []
+    multiplicities = ['', '']
+    arrow = None
+    for j, tok in enumerate(toks):
+        if tok.kind == lexer.STRING:
+            multiplicities[arrow is not None] = _value(source, tok)[1:-1]
+        elif tok.kind == lexer.IDENT and len(operands) == (arrow is not None):
+            operands.append(_value(source, tok))
+        elif tok.kind == lexer.ARROW and arrow is None and operands:
+            arrow = _value(source, tok)
+        elif tok.kind == lexer.COLON and len(operands) == 2:
+            label = _LABEL_DIRECTION.sub('', token_text(source, tok.end, toks[-1].end).strip())
+            break
+        else:
+            return None
+    else:
+        label = ''
+    if len(operands) != 2:
+        return None
+    return operands[0], multiplicities[0], arrow, multiplicities[1], operands[1], label
+
+
+class DiagramParser:
+    """
+    Incremental parser building an `ir.Diagram` one source line at a time.
+
+    `feed` takes a line of text (or `feed_tokens` the tokens of one line)
+    and returns the ClassDecl completed by that line, as soon as its closing
+    brace is read, so callers can start emitting code while the rest of the
+    input is still being parsed. Relationships are resolved by `close`,
+    once every class is known.
+
+    Outside class bodies, braces are matched with a stack of open scopes:
+    `package`/`namespace` blocks, which may nest, and any other `... {`
+    block (`skinparam`, `together`, enums, ...). Every token is looked at
+    a bounded number of times, so parsing is linear in the input size.
+    """
+
+    def __init__(self):
+        self.diagram = ir.Diagram()
+        self._raw_relationships = []
+        self._current = None # ClassDecl whose body is open
+        self._depth = 0 # Brace depth inside the current body
+        self._references = set() # Type names already in the current class's references
+        self._scopes = [] # Open blocks outside class bodies: package name, or None for other blocks
+        self._pending = [] # Lines inside an unterminated /' block comment '/
+        self._comment_open = False
+
+    @property
+    def package(self):
+        """Dotted name of the package/namespace blocks open at the current line ('' at top level)."""
+        return '.'.join(name for name in self._scopes if name)
+
+    def feed(self, line):
+        """Parses one line of text. Returns the ClassDecl it completes, or None."""
+        if self._comment_open or "/'" in line:
+            if self._comment_open: # The line continues the open comment
+                self._comment_open = "'/" not in line or _ends_in_block_comment("/'" + line)
+            else:
+                self._comment_open = _ends_in_block_comment(line)
+            if self._comment_open:
+                self._pending.append(line)
+                return None
+            if self._pending:
+                self._pending.append(line)
+                line = ''.join(self._pending)
+                self._pending = []
+        completed = None
+        for toks in _split_lines(lexer.tokenize(line)):
+            completed = self.feed_tokens(line, toks) or completed
+        return completed
+
+    def feed_tokens(self, source, toks):
+        """
+        Parses the tokens of one line (without its NEWLINE); offsets index into
+        `source`. Returns the ClassDecl the line completes, or None.
+        """
+        if self._current is None:
+            return self._feed_top_level(source, toks)
+        return self._feed_body(source, toks)
+
+    def _feed_top_level(self, source, toks):
+        if not toks:
+            return None
+        if toks[0].kind == lexer.DIRECTIVE:
+            directive, toks = toks[0], toks[1:]
+            if not toks:
+                return None
+            if toks[0].kind != lexer.KEYWORD and _value(source, directive) == '@startuml':
+                self.diagram.name = token_text(source, toks[0].start, toks[-1].end)
+                return None
+            # Otherwise @startuml title ... on one line
+
+        # Closing braces of open scopes and package/namespace headers, e.g. "} }" or "package a { package b {"
+        pos = 0
+        while pos < len(toks):
+            tok = toks[pos]
+            if tok.kind == lexer.RBRACE:
+                if self._scopes:
+                    self._scopes.pop()
+                pos += 1
+            elif tok.kind == lexer.KEYWORD and _value(source, tok) in ('package', 'namespace'):
+                brace = pos + 1
+                while brace < len(toks) and toks[brace].kind != lexer.LBRACE:
+                    brace += 1
+                if brace == len(toks):
+                    return None # A package without a body holds nothing
+                self._scopes.append(_scope_name(source, toks[pos + 1:brace]))
+                pos = brace + 1
+            else:
+                break
+        if pos:
+            toks = toks[pos:]
+            if not toks:
+                return None
+
+        # Declaration header: [abstract] class Name ... [{], abstract Name ... [{] or interface Name ... [{]
+        first = _value(source, toks[0]) if toks[0].kind == lexer.KEYWORD else None
+        if first == 'abstract':
+            kind = ir.ABSTRACT_CLASS
+            pos = 2 if len(toks) > 1 and toks[1].kind == lexer.KEYWORD and _value(source, toks[1]) == 'class' else 1
+        elif first == 'class':
+            kind, pos = ir.CLASS, 1
+        elif first == 'interface':
+            kind, pos = ir.INTERFACE, 1
+        elif first == 'title':
+            if len(toks) > 1:
+                self.diagram.title = token_text(source, toks[1].start, toks[-1].end)
+            return None
+        else:
+            relationship = _parse_relationship(source, toks)
+            if relationship is not None:
+                self._raw_relationships.append((self.package,) + relationship)
+                return None
+            # Any other block (skinparam, together, enum, ...): track its braces
+            for tok in toks:
+                if tok.kind == lexer.LBRACE:
+                    self._scopes.append(None)
+                elif tok.kind == lexer.RBRACE and self._scopes:
+                    self._scopes.pop()
+            return None
+        if pos >= len(toks) or toks[pos].kind != lexer.IDENT:
+            return None
+        package, _, name = _value(source, toks[pos]).rpartition('.') # A qualified name gives its own package
+        package = _java_package(package) if package else self.package
+        name = intern_type(name)
+        stereotypes = []
+        brace = pos + 1 # Skip generics and collect stereotypes up to the body
+        while brace < len(toks) and toks[brace].kind != lexer.LBRACE:
+            if toks[brace].kind == lexer.STEREOTYPE:
+                stereotypes += _stereotypes(_value(source, toks[brace]))
+            brace += 1
+        decl = ir.ClassDecl(name=name, kind=kind, package=package, stereotypes=stereotypes)
+        if brace == len(toks): # Declaration without a body
+            if decl.qualified_name in self.diagram.classes:
+                return None
+            self.diagram.add_class(decl)
+            return decl
+        self.diagram.add_class(decl)
+        self._current = decl
+        self._depth = 1
+        self._references = set()
+        body = toks[brace + 1:]
+        return self._feed_body(source, body) if body else None # One-line body: class Name { + member }
+
+    def _feed_body(self, source, toks):
+        """Parses one line inside a class/interface body: one member per line."""
+        current = self._current
+        member = []
+        for j, tok in enumerate(toks):
+            if tok.kind == lexer.LBRACE:
+                self._depth += 1
+            elif tok.kind == lexer.RBRACE:
+                self._depth -= 1
+                if self._depth == 0:
+                    for rest in toks[j + 1:]: # e.g. "} }" closing the class and its package
+                        if rest.kind == lexer.RBRACE and self._scopes:
+                            self._scopes.pop()
+                    break
+            member.append(tok)
+        refs = []
+        parsed = _parse_member(source, member, refs)
+        seen = self._references
+        for ref in refs:
+            if ref not in seen:
+                seen.add(ref)
+                current.references.append(intern_type(ref))
+        if isinstance(parsed, ir.MethodDecl):
+            current.methods.append(parsed)
+        elif parsed is not None:
+            current.attributes.append(parsed)
+        if self._depth == 0:
+            _infer_attribute_types(current)
+            self._current = None
+            return current
+        return None
+
+    def close(self):
+        """
+        Resolves relationships between the parsed classes, in one pass over
+        the relationship lines, and returns the diagram. The class names on
+        a line are resolved from the package it is written in (see
+        `ir.Diagram.resolve`). Extension and realization set the superclass
+        and interfaces of the child class; every relationship goes into
+        `diagram.relationships` and its graph.
+        """
+        diagram = self.diagram
+        classes = diagram.classes
+        if self._current is not None: # Body left open at the end of the input
+            _infer_attribute_types(self._current)
+        for package, left, left_multiplicity, arrow, right_multiplicity, right, label in self._raw_relationships:
+            source = classes.get(_class_key(diagram, left, package))
+            target = classes.get(_class_key(diagram, right, package))
+            if source is None or target is None:
+                continue
+            kind, forward = _relationship_kind(arrow)
+            if not forward:
+                source, target = target, source
+                left_multiplicity, right_multiplicity = right_multiplicity, left_multiplicity
+            if kind == ir.EXTENDS and target.is_interface and not source.is_interface:
+                kind = ir.IMPLEMENTS # A class "extending" an interface implements it
+            source_key, target_key = source.qualified_name, target.qualified_name
+            if kind == ir.EXTENDS and not source.is_interface:
+                source.superclass = target_key
+            elif kind in (ir.EXTENDS, ir.IMPLEMENTS):
+                source.interfaces.append(target_key) # An interface may extend several
+            diagram.add_relationship(ir.Relationship(source_key, target_key, kind, arrow, intern_type(label),
+                                                     left_multiplicity, right_multiplicity))
+        self._raw_relationships = []
+        return diagram
+
+
+def parse_plantuml(plantuml_content, spans=False):
+    """
+    Parses PlantUML class diagram text in a single pass over its tokens.
+
+    Args:
+        plantuml_content: The raw PlantUML class diagram text, as a str or a
+            bytes-like buffer of UTF-8 (bytes, memoryview, mmap).
+        spans (bool): Tokenize in span mode: tokens are (start, end) offsets
+            into the one shared buffer and only the identifiers and types
+            that end up in the IR are copied out of it. Use this with an
+            mmap'd file to keep peak memory near a single copy of the input.
+
+    Returns:
+        ir.Diagram: The classes, interfaces and relationships of the diagram.
+    """
+    parser = DiagramParser()
+    for toks in _split_lines(lexer.tokenize(plantuml_content, spans=spans)):
+        parser.feed_tokens(plantuml_content, toks)
+    return parser.close()
+
+
+_BLOCK_PATTERN = r'^[ \t]*@startuml\b[\s\S]*?^[ \t]*@enduml\b[^\n]*'
+_BLOCK = re.compile(_BLOCK_PATTERN, re.MULTILINE)
+_BLOCK_BYTES = re.compile(_BLOCK_PATTERN.encode(), re.MULTILINE)
+
+
+def split_blocks(source):
+    """
+    Returns the (start, end) offsets of every @startuml ... @enduml block in
+    `source` (a str or bytes-like buffer). Text without any block is treated
+    as a single diagram spanning the whole source.
+    """
+    pattern = _BLOCK if isinstance(source, str) else _BLOCK_BYTES
+    blocks = [match.span() for match in pattern.finditer(source)]
+    return blocks or [(0, len(source))]
+
+
+_NAME_PATTERN = r'[ \t]*@startuml[ \t]+(?!title\b)([^\n]*[^\s])'
+_TITLE_PATTERN = r'^[ \t]*(?:@startuml[ \t]+)?title[ \t]+([^\n]*[^\s])'
+_NAME = re.compile(_NAME_PATTERN)
+_NAME_BYTES = re.compile(_NAME_PATTERN.encode())
+_TITLE = re.compile(_TITLE_PATTERN, re.MULTILINE)
+_TITLE_BYTES = re.compile(_TITLE_PATTERN.encode(), re.MULTILINE)
+
+
+def block_label(source, start, end):
+    """
+    Returns the name of the diagram block source[start:end] without parsing
+    it: the argument of `@startuml name`, else its first `title`, else None.
+    """
+    is_text = isinstance(source, str)
+    match = (_NAME if is_text else _NAME_BYTES).match(source, start, end) or \
+        (_TITLE if is_text else _TITLE_BYTES).search(source, start, end)
+    if match is None:
+        return None
+    return token_text(source, *match.span(1))
+
+
+@contextmanager
+def map_file(path):
+    """
+    Memory-maps a diagram file read-only and yields the mapping (b'' for an
+    empty file, which cannot be mapped). Pages are loaded by the OS on demand
+    instead of being copied into a Python string.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def parse_file(path):
+    """Parses a diagram file through an mmap in span mode."""
+    with map_file(path) as buffer:
+        return parse_plantuml(buffer, spans=True)
+
+
+def iter_classes(lines, parser=None):
+    """
+    Parses an incremental stream of lines (an open file, a pipe, a generator)
+    and yields each ClassDecl as soon as its closing brace has been read.
+    Only the current line is held in memory. Call `parser.close()` after the
+    stream is exhausted to resolve relationships.
+    """
+    parser = parser if parser is not None else DiagramParser()
+    for line in lines:
+        decl = parser.feed(line)
+        if decl is not None:
+            yield decl
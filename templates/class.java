@@ -0,0 +1,243 @@
+## Java source of one class or interface.
+##
+## Parameters: diagram (ir.Diagram), decl (the ir.ClassDecl to render),
+## imports (the sorted qualified names it needs to import), hierarchy (the
+## diagram's hierarchy.Hierarchy of inheritance closures), associations (the
+## class's generate_code.AssociationFields), value (its
+## generate_code.ValueClass, or None for an ordinary class), builder (its
+## generate_code.BuilderClass, or None) and options (JavaOptions).
+## Helpers: ir, java_type(type, options) lowering a diagram type to Java,
+## format_parameters(parameters, options), class_name(diagram, decl, key)
+## naming a diagram class from this one.
+% if decl.package:
+package ${decl.package};
+
+% endif
+% for name in imports:
+import ${name};
+% endfor
+% if imports:
+
+% endif
+% if value and value.record:
+public record ${decl.name}(${', '.join(f'{component.type} {component.name}' for component in value.components)})\
+% elif value:
+public final class ${decl.name}\
+% elif decl.kind == ir.ABSTRACT_CLASS:
+public abstract class ${decl.name}\
+% elif decl.is_interface:
+public interface ${decl.name}\
+% else:
+public class ${decl.name}\
+% endif
+% if decl.superclass:
+ extends ${class_name(diagram, decl, decl.superclass)}\
+% endif
+% if decl.interfaces:
+ ${'extends' if decl.is_interface else 'implements'} ${', '.join(class_name(diagram, decl, key) for key in decl.interfaces)}\
+% endif
+ {
+% if value:
+## Value class: immutable components, compared, hashed and printed by value
+%   statics = [attr for attr in decl.attributes if attr.is_static]
+%   for attr in statics:
+    ${attr.visibility} static ${java_type(attr.type, options)} ${attr.name};
+%   endfor
+%   if not value.record:
+%     for component in value.components:
+    private final ${component.type} ${component.name};
+%     endfor
+    private int ${value.hash_field}; // hashCode(), computed on first use
+%   endif
+%   if statics or not value.record:
+
+%   endif
+%   if not value.record:
+    public ${decl.name}(${', '.join(f'{component.type} {component.name}' for component in value.components)}) {
+%     for component in value.components:
+        this.${component.name} = ${component.name};
+%     endfor
+    }
+
+%     for component in value.components:
+    public ${component.type} get${component.name.capitalize()}() {
+        return ${component.name};
+    }
+
+%     endfor
+%   endif
+%   if value.explicit:
+    @Override
+    public boolean equals(Object o) {
+%     if value.components:
+        if (this == o) {
+            return true;
+        }
+        if (!(o instanceof ${decl.name})) {
+            return false;
+        }
+        ${decl.name} other = (${decl.name}) o;
+        return ${'\n                && '.join(component.equals for component in value.components)};
+%     else:
+        return o instanceof ${decl.name};
+%     endif
+    }
+
+    @Override
+    public int hashCode() {
+%     if value.hash_field:
+        int h = ${value.hash_field};
+        if (h == 0) {
+%       for component in value.components:
+            h = 31 * h + ${component.hash};
+%       endfor
+            ${value.hash_field} = h;
+        }
+        return h;
+%     else:
+        int h = 0;
+%       for component in value.components:
+        h = 31 * h + ${component.hash};
+%       endfor
+        return h;
+%     endif
+    }
+
+    @Override
+    public String toString() {
+        return ${value.to_string};
+    }
+
+%   endif
+% else:
+%   for attr in decl.attributes:
+    ${attr.visibility} ${'static ' if attr.is_static else ''}${java_type(attr.type, options)} ${attr.name};
+%   endfor
+%   for field in associations:
+    private ${field.type} ${field.name}${' = ' + field.initializer if field.initializer else ''};
+%   endfor
+%   if decl.attributes or associations:
+
+%   endif
+## Constructor taking every inherited instance attribute (passed to super) and the class's own
+%   instance = [attr for attr in decl.attributes if not attr.is_static]
+%   if not decl.is_interface:
+%     inherited = list(hierarchy.inherited_attributes(decl.qualified_name))
+    public ${decl.name}(${', '.join(f'{java_type(attr.type, options)} {attr.name}' for attr in inherited + instance)}) {
+%     if inherited:
+        super(${', '.join(attr.name for attr in inherited)});
+%     endif
+%     for attr in instance:
+        this.${attr.name} = ${attr.name};
+%     endfor
+    }
+
+%   endif
+## Getters and setters for private instance attributes and association fields
+%   accessors = [attr for attr in instance if attr.visibility == 'private'] + associations
+%   for attr in accessors:
+    public ${java_type(attr.type, options)} get${attr.name.capitalize()}() {
+        return ${attr.name};
+    }
+
+    public void set${attr.name.capitalize()}(${java_type(attr.type, options)} ${attr.name}) {
+        this.${attr.name} = ${attr.name};
+    }
+
+%   endfor
+% endif
+% for method in decl.methods:
+%   modifiers = ('abstract ' if decl.kind == ir.ABSTRACT_CLASS and method.is_abstract else '') + ('static ' if method.is_static else '')
+    ${'public' if decl.is_interface else method.visibility} ${modifiers}${java_type(method.return_type, options)} ${method.name}(${format_parameters(method.parameters, options)})\
+%   if decl.is_interface or modifiers == 'abstract ':
+;
+
+%   else:
+ {
+        // TODO: Implement method logic
+%     if method.return_type != 'void':
+        return default${method.return_type}Value(); // Placeholder return
+%     endif
+    }
+
+%   endif
+% endfor
+## Stubs for the abstract methods the class inherits but implements nowhere
+% for owner, method in hierarchy.missing_methods(decl.qualified_name):
+    @Override
+    ${'public' if owner.is_interface else method.visibility} ${java_type(method.return_type, options)} ${method.name}(${format_parameters(method.parameters, options)}) {
+        // TODO: Implement method logic
+        throw new UnsupportedOperationException("Unimplemented method '${method.name}'");
+    }
+
+% endfor
+## Builder setting the constructor's arguments by name, and its static factory
+% if builder:
+%   if builder.pool_field:
+    private static final ThreadLocal<Builder> ${builder.pool_field} = ThreadLocal.withInitial(Builder::new);
+
+%   endif
+%   if not builder.abstract:
+    public static Builder builder() {
+%     if builder.pool_field:
+        return ${builder.pool_field}.get().reset();
+%     else:
+        return new Builder();
+%     endif
+    }
+
+%   endif
+    public ${'abstract ' if builder.abstract else ''}static class Builder${' extends ' + builder.parent + '.Builder' if builder.parent else ''} {
+%   own = [property for property in builder.properties if not property.inherited]
+%   for property in own:
+        protected ${property.type} ${property.name};
+%   endfor
+%   if own:
+
+%   endif
+        protected Builder() {
+        }
+
+%   for property in builder.properties:
+%     if property.inherited:
+        @Override
+%     endif
+        public Builder ${property.name}(${property.type} ${property.name}) {
+%     if property.inherited:
+            super.${property.name}(${property.name});
+%     else:
+            this.${property.name} = ${property.name};
+%     endif
+            return this;
+        }
+
+%   endfor
+%   if builder.pooled:
+%     if builder.parent:
+        @Override
+%     endif
+        public Builder reset() {
+%     if builder.parent:
+            super.reset();
+%     endif
+%     for property in own:
+            ${property.name} = ${property.default};
+%     endfor
+            return this;
+        }
+
+%   endif
+%   if builder.abstract:
+        public abstract ${decl.name} build();
+%   else:
+%     if builder.parent:
+        @Override
+%     endif
+        public ${decl.name} build() {
+            return new ${decl.name}(${', '.join(property.name for property in builder.properties)});
+        }
+%   endif
+    }
+
+% endif
+}